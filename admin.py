@@ -0,0 +1,37 @@
+import hmac
+import os
+from functools import wraps
+
+from flask import abort, request
+
+ADMIN_HEADER = "X-Admin-Token"
+
+
+def admin_token():
+    """Return the configured admin token, or None when admin routes are disabled."""
+    return os.environ.get("PASTE_ADMIN_TOKEN") or None
+
+
+def check_token(supplied):
+    """Check a supplied token against the configured admin token."""
+    token = admin_token()
+    if not token or not supplied:
+        return False
+    return hmac.compare_digest(token, supplied)
+
+
+def is_admin():
+    """Check whether the current request carries a valid admin token."""
+    return check_token(request.headers.get(ADMIN_HEADER))
+
+
+def admin_required(view):
+    """Hide a view behind the admin token; unknown callers just see a 404."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            abort(404)
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -1,28 +1,60 @@
 import os
 import secrets
-import sqlite3
-
-from flask import Flask, flash, redirect, render_template, request, url_for
+from urllib.parse import urlsplit
+
+from flask import (
+    Flask,
+    Response,
+    abort,
+    flash,
+    g,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+
+import backup
+import metrics
+import passwords
+import profiling
+import ratelimit
+import timing
+import upload
+from delta import DIFF_MAX_LINES, diff_lines
+from storage import create_storage
+from views import ViewCounter
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)  # For flash messages
-DB_PATH = "pastes_advanced.db"
+# Signs flash messages and unlock cookies; set it when workers are not forked
+# from one preloaded app, so they all accept each other's cookies
+app.secret_key = os.environ.get("PASTE_SECRET_KEY") or secrets.token_hex(16)
+app.config["PASTE_STORAGE"] = os.environ.get("PASTE_STORAGE", "sqlite")
+app.config["PASTE_CACHE_SIZE"] = int(os.environ.get("PASTE_CACHE_SIZE", "1024"))
+# Largest accepted request body, for form posts and raw uploads alike
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("PASTE_MAX_BYTES", "2097152"))
+app.config["MAX_FORM_MEMORY_SIZE"] = app.config["MAX_CONTENT_LENGTH"]
+DB_PATH = os.environ.get("PASTE_DB_PATH", "pastes_advanced.db")
+WINDOW_LINES = 500  # Lines rendered per window of a large paste
+
+storage = create_storage(
+    app.config["PASTE_STORAGE"], DB_PATH, cache_size=app.config["PASTE_CACHE_SIZE"]
+)
+if storage.db_path:
+    backup.init_app(app, storage.db_path)
+metrics.init_app(app, storage)
+profiling.init_app(app)
+timing.init_app(app, storage)
+ratelimit.init_app(app)
+view_counter = ViewCounter(
+    storage, interval=float(os.environ.get("PASTE_VIEW_FLUSH_INTERVAL", "5"))
+)
 
 
 def init_db():
-    """Initialize the SQLite database with the pastes table."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS pastes (
-            id TEXT PRIMARY KEY,
-            content TEXT NOT NULL,
-            title TEXT,
-            language TEXT DEFAULT 'plaintext',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            password TEXT
-        )
-        """)
+    """Initialize the paste storage."""
+    storage.init_db()
 
 
 def generate_paste_id(length=8):
@@ -30,19 +62,56 @@ def generate_paste_id(length=8):
     return secrets.token_urlsafe(length)[:length]
 
 
+upload.init_app(app, storage, generate_paste_id)
+
+
+def parse_line_range(value, default_end=WINDOW_LINES):
+    """Parse a ``start-end`` line range (1-based, inclusive).
+
+    Returns ``(start, end)``, falling back to the first window when the
+    value is missing or malformed. A range is never longer than
+    WINDOW_LINES; the whole text is only served by ``/paste/<id>/raw``.
+    """
+    try:
+        start, _, end = (value or "").partition("-")
+        start = max(int(start), 1)
+        end = int(end) if end else start + WINDOW_LINES - 1
+    except ValueError:
+        return 1, default_end
+    return start, min(max(end, start), start + WINDOW_LINES - 1)
+
+
+def paste_page(target, paste_id):
+    """Return ``target`` if it is one of ``paste_id``'s own pages, else None.
+
+    The path must match a page of the paste exactly, so nothing like
+    ``/paste/<id>x/../..`` or another host gets through; a query string is
+    kept.
+    """
+    parts = urlsplit(target)
+    pages = {
+        url_for(endpoint, paste_id=paste_id)
+        for endpoint in (
+            "view_paste",
+            "paste_lines",
+            "raw_paste",
+            "fork_paste",
+            "diff_paste",
+        )
+    }
+    if parts.scheme or parts.netloc or parts.path not in pages:
+        return None
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
 @app.route("/")
 def index():
-    """Display the home page with recent pastes."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute("""
-        SELECT id, title, created_at 
-        FROM pastes 
-        WHERE expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP 
-        ORDER BY created_at DESC 
-        LIMIT 10
-        """)
-        recent_pastes = cursor.fetchall()
-    return render_template("index.html", recent_pastes=recent_pastes)
+    """Display the home page with recent and popular pastes."""
+    recent_pastes = storage.recent(10)
+    popular_pastes = storage.popular(10)
+    return render_template(
+        "index.html", recent_pastes=recent_pastes, popular_pastes=popular_pastes
+    )
 
 
 @app.route("/paste", methods=["POST"])
@@ -50,20 +119,27 @@ def create_paste():
     """Create a new paste."""
     content = request.form.get("content")
     title = request.form.get("title", "Untitled")
-    password = request.form.get("password")
+    password = request.form.get("password") or None
     language = request.form.get("language", "plaintext")
+    parent_id = request.form.get("parent_id") or None
 
     if not content:
         flash("Paste content cannot be empty!", "danger")
         return redirect(url_for("index"))
 
-    paste_id = generate_paste_id()
+    if password:
+        password = passwords.hash_password(password)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "INSERT INTO pastes (id, content, title, password, language) VALUES (?, ?, ?, ?, ?)",
-            (paste_id, content, title, password, language),
-        )
+    paste_id = generate_paste_id()
+    g.paste_id = paste_id  # For the access log
+    storage.create(
+        paste_id,
+        content,
+        title=title,
+        password=password,
+        language=language,
+        parent_id=parent_id,
+    )
 
     flash("Paste created successfully!", "success")
     return redirect(url_for("view_paste", paste_id=paste_id))
@@ -71,29 +147,139 @@ def create_paste():
 
 @app.route("/paste/<paste_id>")
 def view_paste(paste_id):
-    """View a specific paste."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT content, title, created_at, password, language FROM pastes WHERE id = ?",
-            (paste_id,),
-        )
-        paste = cursor.fetchone()
+    """View a specific paste, one window of lines at a time."""
+    paste = storage.get(paste_id, content=False)
 
     if not paste:
         flash("Paste not found!", "danger")
         return redirect(url_for("index"))
 
-    content, title, created_at, has_password, language = paste
-    if has_password and request.args.get("password") != has_password:
+    if paste.password and not passwords.is_unlocked(paste_id):
         return render_template("password.html", paste_id=paste_id)
 
+    view_counter.record(paste_id)
+    start, end = parse_line_range(request.args.get("lines"))
+    window = storage.get_lines(paste_id, start, end)
+    content, start, end, line_count = window or ("", 1, 0, 0)
     return render_template(
         "view.html",
         content=content,
-        title=title,
-        created_at=created_at,
+        title=paste.title,
+        created_at=paste.created_at,
         paste_id=paste_id,
-        language=language,
+        parent_id=paste.parent_id,
+        language=paste.language,
+        start=start,
+        end=end,
+        line_count=line_count,
+        window_lines=WINDOW_LINES,
+    )
+
+
+@app.route("/paste/<paste_id>/unlock", methods=["POST"])
+def unlock_paste(paste_id):
+    """Check a paste's password once and remember the unlock in a signed cookie."""
+    paste = storage.get(paste_id, content=False)
+
+    if not paste:
+        flash("Paste not found!", "danger")
+        return redirect(url_for("index"))
+
+    if paste.password and not passwords.check_password(
+        paste.password, request.form.get("password")
+    ):
+        flash("Incorrect password!", "danger")
+        return render_template("password.html", paste_id=paste_id), 403
+
+    if paste.password:
+        passwords.upgrade(storage, paste, request.form.get("password"))
+
+    # Only return to pages of this paste, never to an arbitrary URL
+    target = paste_page(request.form.get("next", ""), paste_id) or url_for(
+        "view_paste", paste_id=paste_id
+    )
+    return passwords.unlock(redirect(target), paste_id)
+
+
+@app.route("/paste/<paste_id>/lines")
+def paste_lines(paste_id):
+    """Return a window of lines as JSON for incremental loading."""
+    paste = storage.get(paste_id, content=False)
+    if not paste:
+        abort(404)
+    if paste.password and not passwords.is_unlocked(paste_id):
+        abort(403)
+
+    start, end = parse_line_range(request.args.get("lines"))
+    window = storage.get_lines(paste_id, start, end)
+    content, start, end, line_count = window or ("", 1, 0, 0)
+    return jsonify(content=content, start=start, end=end, line_count=line_count)
+
+
+@app.route("/paste/<paste_id>/raw")
+def raw_paste(paste_id):
+    """Return a paste's full text as plain text, for copying and downloads."""
+    paste = storage.get(paste_id)
+    if not paste:
+        abort(404)
+    if paste.password and not passwords.is_unlocked(paste_id):
+        abort(403)
+
+    # nosniff: never let a browser render a paste as HTML
+    return Response(
+        paste.content,
+        mimetype="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"},
+    )
+
+
+@app.route("/paste/<paste_id>/fork")
+def fork_paste(paste_id):
+    """Open the create form pre-filled with a paste, to save an edited revision."""
+    paste = storage.get(paste_id)
+
+    if not paste:
+        flash("Paste not found!", "danger")
+        return redirect(url_for("index"))
+
+    if paste.password and not passwords.is_unlocked(paste_id):
+        return render_template("password.html", paste_id=paste_id)
+
+    return render_template(
+        "index.html",
+        recent_pastes=storage.recent(10),
+        popular_pastes=storage.popular(10),
+        fork=paste,
+    )
+
+
+@app.route("/paste/<paste_id>/diff")
+def diff_paste(paste_id):
+    """Show what a revision changed relative to its parent."""
+    paste = storage.get(paste_id)
+
+    if not paste:
+        flash("Paste not found!", "danger")
+        return redirect(url_for("index"))
+
+    if paste.password and not passwords.is_unlocked(paste_id):
+        return render_template("password.html", paste_id=paste_id)
+
+    parent = storage.get(paste.parent_id) if paste.parent_id else None
+    if not parent:
+        flash("This paste has no parent revision to compare with.", "warning")
+        return redirect(url_for("view_paste", paste_id=paste_id))
+    if parent.password and not passwords.is_unlocked(parent.id):
+        flash("The parent paste is password protected.", "danger")
+        return redirect(url_for("view_paste", paste_id=paste_id))
+
+    return render_template(
+        "diff.html",
+        diff=diff_lines(parent.content, paste.content, parent.id, paste.id),
+        max_lines=DIFF_MAX_LINES,
+        title=paste.title,
+        paste_id=paste_id,
+        parent_id=parent.id,
     )
 
 
@@ -102,6 +288,7 @@ def view_paste(paste_id):
 #   ├── base.html
 #   ├── index.html
 #   ├── view.html
+#   ├── diff.html
 #   └── password.html
 
 # Create the templates directory
@@ -173,6 +360,7 @@ base_html = """
     <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-bash.min.js"></script>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-yaml.min.js"></script>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-json.min.js"></script>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-diff.min.js"></script>
 </body>
 </html>
 """
@@ -184,11 +372,22 @@ index_html = """
 {% block content %}
 <div class="row">
     <div class="col-md-8">
+        {% if fork %}
+        <h2>Edit Revision</h2>
+        <p class="text-muted">
+            Saving creates a new paste linked to
+            <a href="{{ url_for('view_paste', paste_id=fork.id) }}">{{ fork.title or 'Untitled' }}</a>.
+        </p>
+        {% else %}
         <h2>Create New Paste</h2>
+        {% endif %}
         <form method="POST" action="{{ url_for('create_paste') }}">
+            {% if fork %}
+            <input type="hidden" name="parent_id" value="{{ fork.id }}">
+            {% endif %}
             <div class="mb-3">
                 <label for="title" class="form-label">Title</label>
-                <input type="text" class="form-control" id="title" name="title" placeholder="Optional title">
+                <input type="text" class="form-control" id="title" name="title" placeholder="Optional title" value="{{ fork.title if fork else '' }}">
             </div>
             <div class="mb-3">
                 <label for="language" class="form-label">Language</label>
@@ -208,7 +407,8 @@ index_html = """
             </div>
             <div class="mb-3">
                 <label for="content" class="form-label">Content</label>
-                <textarea class="form-control" id="content" name="content" rows="10"></textarea>
+                <textarea class="form-control" id="content" name="content" rows="10">{% if fork %}
+{{ fork.content }}{% endif %}</textarea>
             </div>
             <script>
                 // Wait for the DOM and scripts to be fully loaded
@@ -229,17 +429,6 @@ index_html = """
                         return;
                     }
 
-                    // Initialize CodeMirror
-                    var editor = CodeMirror.fromTextArea(document.getElementById("content"), {
-                        lineNumbers: true,
-                        theme: "monokai",
-                        mode: "plaintext",
-                        matchBrackets: true,
-                        autoCloseBrackets: true,
-                        indentUnit: 4,
-                        indentWithTabs: false
-                    });
-
                     // Map language selections to CodeMirror modes
                     const languageModes = {
                         'plaintext': 'plaintext',
@@ -255,6 +444,22 @@ index_html = """
                         'json': { name: 'javascript', json: true }
                     };
 
+                    {% if fork %}
+                    // Start from the language of the paste being edited
+                    document.getElementById('language').value = {{ fork.language|tojson }};
+                    {% endif %}
+
+                    // Initialize CodeMirror
+                    var editor = CodeMirror.fromTextArea(document.getElementById("content"), {
+                        lineNumbers: true,
+                        theme: "monokai",
+                        mode: languageModes[document.getElementById('language').value] || 'plaintext',
+                        matchBrackets: true,
+                        autoCloseBrackets: true,
+                        indentUnit: 4,
+                        indentWithTabs: false
+                    });
+
                     // Update editor mode when language is changed
                     document.getElementById('language').addEventListener('change', function() {
                         const mode = languageModes[this.value] || 'plaintext';
@@ -271,7 +476,7 @@ index_html = """
                 <label for="password" class="form-label">Password (optional)</label>
                 <input type="password" class="form-control" id="password" name="password">
             </div>
-            <button type="submit" class="btn btn-primary">Create Paste</button>
+            <button type="submit" class="btn btn-primary">{{ 'Save Revision' if fork else 'Create Paste' }}</button>
         </form>
     </div>
     
@@ -292,6 +497,22 @@ index_html = """
         {% else %}
             <p>No recent pastes.</p>
         {% endif %}
+
+        <h2 class="mt-4">Popular Pastes</h2>
+        {% if popular_pastes %}
+            <ul class="list-group">
+            {% for paste_id, title, created_at, views in popular_pastes %}
+                <li class="list-group-item d-flex justify-content-between align-items-start">
+                    <a href="{{ url_for('view_paste', paste_id=paste_id) }}">
+                        {{ title or 'Untitled' }}
+                    </a>
+                    <span class="badge bg-secondary rounded-pill">{{ views }} views</span>
+                </li>
+            {% endfor %}
+            </ul>
+        {% else %}
+            <p>No popular pastes yet.</p>
+        {% endif %}
     </div>
 </div>
 {% endblock %}
@@ -307,10 +528,17 @@ view_html = """
 <div class="row">
     <div class="col-12">
         <h2>{{ title or 'Untitled' }}</h2>
-        <p class="text-muted">Created: {{ created_at }}</p>
+        <p class="text-muted">
+            Created: {{ created_at }}
+            {% if parent_id %}
+            &middot; Revision of <a href="{{ url_for('view_paste', paste_id=parent_id) }}">{{ parent_id }}</a>
+            {% endif %}
+        </p>
         <div class="card">
             <div class="card-header d-flex justify-content-between">
                 <p class="text-muted">{{ language }}</p>
+                <div>
+                <a class="btn btn-sm btn-outline-secondary" href="{{ url_for('raw_paste', paste_id=paste_id) }}">Raw</a>
                 <button class="btn btn-sm btn-secondary" onclick="copyContent()">
                     <svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-clipboard me-1" viewBox="0 0 16 16">
                         <path d="M4 1.5H3a2 2 0 0 0-2 2V14a2 2 0 0 0 2 2h10a2 2 0 0 0 2-2V3.5a2 2 0 0 0-2-2h-1v1h1a1 1 0 0 1 1 1V14a1 1 0 0 1-1 1H3a1 1 0 0 1-1-1V3.5a1 1 0 0 1 1-1h1v-1z"/>
@@ -318,25 +546,94 @@ view_html = """
                     </svg>
                     Copy
                 </button>
+                </div>
             </div>
-            <div class="card-body">
-                <pre class="line-numbers"><code class="language-{{ language }}">{{ content }}</code></pre>
+            <div class="card-body" id="paste-body">
+                <pre class="line-numbers" data-start="{{ start }}"><code class="language-{{ language }}">{{ content }}</code></pre>
+            </div>
+            {% if start > 1 or end < line_count %}
+            <div class="card-footer d-flex justify-content-between align-items-center">
+                <small class="text-muted">
+                    Lines {{ start }}-<span id="window-end">{{ end }}</span> of {{ line_count }}
+                </small>
+                <div>
+                    {% if start > 1 %}
+                    <a class="btn btn-sm btn-outline-secondary" href="{{ url_for('view_paste', paste_id=paste_id, lines='%d-%d' % ([start - window_lines, 1]|max, start - 1)) }}">Previous</a>
+                    {% endif %}
+                    {% if end < line_count %}
+                    <button class="btn btn-sm btn-outline-primary" id="load-more" onclick="loadMore()"
+                            data-next="{{ end + 1 }}" data-total="{{ line_count }}">Load more</button>
+                    {% endif %}
+                </div>
             </div>
+            {% endif %}
         </div>
         <div class="mt-3">
             <a href="{{ url_for('index') }}" class="btn btn-secondary">Back to Home</a>
+            <a href="{{ url_for('fork_paste', paste_id=paste_id) }}" class="btn btn-outline-primary">Edit as New Revision</a>
+            {% if parent_id %}
+            <a href="{{ url_for('diff_paste', paste_id=paste_id) }}" class="btn btn-outline-secondary">Diff with Parent</a>
+            {% endif %}
         </div>
     </div>
 </div>
 
 <script>
+function loadMore() {
+    // Fetch the next window of lines and append it as its own highlighted block
+    const button = document.getElementById('load-more');
+    const next = parseInt(button.dataset.next, 10);
+    const total = parseInt(button.dataset.total, 10);
+    const params = new URLSearchParams(window.location.search);
+    params.set('lines', next + '-' + (next + {{ window_lines }} - 1));
+    button.disabled = true;
+
+    fetch('{{ url_for('paste_lines', paste_id=paste_id) }}?' + params.toString())
+        .then(response => response.json())
+        .then(data => {
+            const pre = document.createElement('pre');
+            pre.className = 'line-numbers';
+            pre.dataset.start = data.start;
+            const code = document.createElement('code');
+            code.className = 'language-{{ language }}';
+            code.textContent = data.content;
+            pre.appendChild(code);
+            document.getElementById('paste-body').appendChild(pre);
+            Prism.highlightElement(code);
+
+            document.getElementById('window-end').textContent = data.end;
+            if (data.end >= total) {
+                button.remove();
+            } else {
+                button.dataset.next = data.end + 1;
+                button.disabled = false;
+            }
+        })
+        .catch(err => {
+            console.error('Failed to load more lines: ', err);
+            button.disabled = false;
+        });
+}
+
+function pasteText() {
+    {% if start == 1 and end >= line_count %}
+    // The whole paste is on the page
+    const codeElements = document.querySelectorAll('pre code');
+    return Promise.resolve(Array.from(codeElements, el => el.textContent).join(''));
+    {% else %}
+    // Only some windows are loaded, so fetch the full text
+    return fetch('{{ url_for('raw_paste', paste_id=paste_id) }}').then(response => {
+        if (!response.ok) {
+            throw new Error('HTTP ' + response.status);
+        }
+        return response.text();
+    });
+    {% endif %}
+}
+
 function copyContent() {
-    // Get the content from the code element
-    const codeElement = document.querySelector('pre code');
-    const textToCopy = codeElement.textContent;
-    
     // Copy to clipboard
-    navigator.clipboard.writeText(textToCopy).then(() => {
+    pasteText().then(text => navigator.clipboard.writeText(text)).then(() => {
         // Change button text temporarily to show success
         const button = document.querySelector('button');
         const originalHTML = button.innerHTML;
@@ -360,6 +657,39 @@ function copyContent() {
 {% endblock %}
 """
 
+# diff.html template
+diff_html = """
+{% extends "base.html" %}
+
+{% block title %}Changes in {{ title }} - Personal Pastebin{% endblock %}
+
+{% block content %}
+<div class="row">
+    <div class="col-12">
+        <h2>Changes in {{ title or 'Untitled' }}</h2>
+        <p class="text-muted">
+            Compared with its parent
+            <a href="{{ url_for('view_paste', paste_id=parent_id) }}">{{ parent_id }}</a>
+        </p>
+        <div class="card">
+            <div class="card-body">
+                {% if diff is none %}
+                <p class="text-muted mb-0">Too large to diff: one side has more than {{ max_lines }} lines.</p>
+                {% elif diff %}
+                <pre><code class="language-diff">{{ diff }}</code></pre>
+                {% else %}
+                <p class="text-muted mb-0">No changes.</p>
+                {% endif %}
+            </div>
+        </div>
+        <div class="mt-3">
+            <a href="{{ url_for('view_paste', paste_id=paste_id) }}" class="btn btn-secondary">Back to Paste</a>
+        </div>
+    </div>
+</div>
+{% endblock %}
+"""
+
 # password.html template
 password_html = """
 {% extends "base.html" %}
@@ -368,7 +698,8 @@ password_html = """
 <div class="row">
     <div class="col-md-6 offset-md-3">
         <h2>Password Protected Paste</h2>
-        <form method="GET">
+        <form method="POST" action="{{ url_for('unlock_paste', paste_id=paste_id) }}">
+            <input type="hidden" name="next" value="{{ request.form.get('next', '') if request.endpoint == 'unlock_paste' else request.full_path }}">
             <div class="mb-3">
                 <label for="password" class="form-label">Enter Password</label>
                 <input type="password" class="form-control" id="password" name="password" required>
@@ -387,6 +718,8 @@ with open("templates/index.html", "w") as f:
     f.write(index_html)
 with open("templates/view.html", "w") as f:
     f.write(view_html)
+with open("templates/diff.html", "w") as f:
+    f.write(diff_html)
 with open("templates/password.html", "w") as f:
     f.write(password_html)
 
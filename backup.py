@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from flask import jsonify
+
+from admin import admin_required
+
+logger = logging.getLogger("paste.backup")
+
+BACKUP_DIR = "backups"
+DEFAULT_PAGES = 256  # Pages copied per step; small steps keep the read lock short
+DEFAULT_SLEEP = 0.05  # Seconds to yield to writers between steps
+
+
+def backup_database(
+    src_path, dest_path, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP, progress=None
+):
+    """Copy a live SQLite database with the online backup API.
+
+    The copy is made ``pages`` pages at a time, sleeping ``sleep`` seconds
+    between steps so writers can take the lock in between. On a WAL database
+    the copy reads from a single snapshot, so concurrent writes neither block
+    nor restart it; in rollback-journal mode every write from another
+    connection restarts the copy. The result is
+    written to a temporary file and renamed into place once complete, so
+    ``dest_path`` never holds a half-written backup, and the temporary
+    file is removed if the copy fails.
+
+    ``progress`` is called after every step with a dict of the current
+    stats. The final stats dict is returned.
+    """
+    tmp_path = f"{dest_path}.part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    stats = {
+        "source": src_path,
+        "destination": dest_path,
+        "pages_total": 0,
+        "pages_done": 0,
+        "bytes_done": 0,
+        "steps": 0,
+        "elapsed": 0.0,
+        "bytes_per_second": 0.0,
+    }
+    started = time.monotonic()
+
+    try:
+        src = sqlite3.connect(src_path)
+        dest = sqlite3.connect(tmp_path)
+        try:
+            page_size = src.execute("PRAGMA page_size").fetchone()[0]
+            journal_mode = src.execute("PRAGMA journal_mode").fetchone()[0]
+            if journal_mode == "wal":
+                # Pin a read snapshot for the whole copy. In WAL mode this does not
+                # block writers, and it stops their commits from restarting the
+                # backup between steps.
+                src.execute("BEGIN")
+                src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+            def on_step(status, remaining, total):
+                elapsed = time.monotonic() - started
+                done = total - remaining
+                stats.update(
+                    pages_total=total,
+                    pages_done=done,
+                    bytes_done=done * page_size,
+                    steps=stats["steps"] + 1,
+                    elapsed=elapsed,
+                    bytes_per_second=done * page_size / elapsed if elapsed else 0.0,
+                )
+                if progress:
+                    progress(dict(stats))
+                if remaining and sleep:
+                    time.sleep(sleep)
+
+            src.backup(dest, pages=pages, progress=on_step)
+        finally:
+            dest.close()
+            src.close()
+
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    stats["elapsed"] = time.monotonic() - started
+    return stats
+
+
+def backup_filename(db_path):
+    """Build a timestamped backup filename for a database path."""
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    return f"{stem}-{stamp}.db"
+
+
+class BackupState:
+    """Progress of the running or most recent backup, shared by all workers.
+
+    It lives in the backups directory rather than in process memory, so any
+    gunicorn worker can answer for a backup another one started.
+    ``backup.lock`` is flock()ed for as long as a backup runs, and
+    ``backup.json`` holds its latest stats. The kernel drops the lock when
+    its holder dies, so a killed worker never leaves a backup "running".
+    """
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.lock_path = os.path.join(backup_dir, "backup.lock")
+        self.status_path = os.path.join(backup_dir, "backup.json")
+
+    def acquire(self):
+        """Take the backup lock; returns its file descriptor, or None if taken.
+
+        The lock is held until the descriptor is closed.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def running(self):
+        try:
+            fd = os.open(self.lock_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def read(self):
+        try:
+            with open(self.status_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"last": None, "error": None}
+
+    def write(self, last, error=None):
+        # Replaced whole, so readers never see a half-written file
+        tmp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"last": last, "error": error}, f)
+        os.replace(tmp_path, self.status_path)
+
+
+def init_app(app, db_path, backup_dir=BACKUP_DIR):
+    """Register the ``/admin/backup`` endpoints on a paste app.
+
+    ``POST`` starts a backup in a background thread and returns immediately;
+    ``GET`` reports the progress of the running or most recent backup. Only
+    one backup runs at a time across all workers.
+    """
+    state = BackupState(backup_dir)
+
+    def run(dest_path, lock_fd):
+        try:
+            state.write(backup_database(db_path, dest_path, progress=state.write))
+        except (sqlite3.Error, OSError) as exc:
+            # Recorded so a failed backup never reads as a finished one
+            try:
+                state.write(state.read()["last"], error=str(exc))
+            except OSError:
+                logger.exception("Backup failed and its status could not be saved")
+        finally:
+            os.close(lock_fd)
+
+    @app.route("/admin/backup", methods=["POST"])
+    @admin_required
+    def start_backup():
+        """Start an online backup of the paste database."""
+        lock_fd = state.acquire()
+        if lock_fd is None:
+            return jsonify(running=True, progress=state.read()["last"]), 409
+
+        dest_path = os.path.join(backup_dir, backup_filename(db_path))
+        state.write(None)
+        threading.Thread(target=run, args=(dest_path, lock_fd), daemon=True).start()
+        return jsonify(running=True, destination=dest_path), 202
+
+    @app.route("/admin/backup", methods=["GET"])
+    @admin_required
+    def backup_status():
+        """Report progress of the current or last backup."""
+        status = state.read()
+        return jsonify(
+            running=state.running(), progress=status["last"], error=status["error"]
+        )
+
+    app.extensions["backup"] = state
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Take an online backup of a paste database without blocking writers."
+    )
+    parser.add_argument("source", help="Path of the live database")
+    parser.add_argument(
+        "destination",
+        nargs="?",
+        help=f"Backup file (default: a timestamped file in {BACKUP_DIR}/)",
+    )
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES)
+    parser.add_argument("--sleep", type=float, default=DEFAULT_SLEEP)
+    args = parser.parse_args()
+
+    dest_path = args.destination
+    if not dest_path:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        dest_path = os.path.join(BACKUP_DIR, backup_filename(args.source))
+
+    def report(stats):
+        percent = 100 * stats["pages_done"] / max(stats["pages_total"], 1)
+        print(
+            f"\r{percent:5.1f}% {stats['pages_done']}/{stats['pages_total']} pages "
+            f"{stats['bytes_per_second'] / 1024 / 1024:.2f} MiB/s",
+            end="",
+            flush=True,
+        )
+
+    stats = backup_database(
+        args.source, dest_path, pages=args.pages, sleep=args.sleep, progress=report
+    )
+    print(
+        f"\nBacked up {stats['bytes_done']} bytes to {dest_path} "
+        f"in {stats['elapsed']:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+import argparse
+import contextlib
+import http.client
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+import seed
+from backup import backup_database
+
+VARIANTS = ("simple", "intermediate", "advanced")
+DEFAULT_ROWS = (1_000, 100_000, 10_000_000)
+DEFAULT_SIZES = (100, 10_000, 1_000_000)
+DATA_DIR = "bench_data"
+RESULTS_DIR = "bench_results"
+SAMPLE_IDS = 1_000
+WARMUP_REQUESTS = 20
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Reduce raw latencies (seconds) to the numbers stored in results."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def make_content(size, rng):
+    """Build paste text of roughly ``size`` characters in ~60 character lines."""
+    line = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz ", k=59)) + "\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+@contextlib.contextmanager
+def scratch_copy(db_path):
+    """Copy a seeded database for one case, and delete the copy afterwards.
+
+    Cases create pastes. On the shared file those would pile up for every
+    later case and run, and none would measure the row count it is
+    labelled with.
+    """
+    scratch_path = f"{os.path.splitext(db_path)[0]}.scratch.db"
+    backup_database(db_path, scratch_path, pages=-1, sleep=0)
+    try:
+        yield scratch_path
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(scratch_path + suffix)
+
+
+def run_client_case(variant, db_path, sample_ids, sizes, requests, seed):
+    """Benchmark one app through the Flask test client.
+
+    Runs in a fresh (spawned) process: every variant writes its own
+    templates at import time, so two variants must never share a process.
+    """
+    os.environ["PASTE_DB_PATH"] = db_path
+    module = importlib.import_module(variant)
+    module.init_db()
+    client = module.app.test_client()
+    rng = random.Random(seed)
+
+    def measure(call, count):
+        for _ in range(min(WARMUP_REQUESTS, count)):
+            call()
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(count):
+            t0 = time.perf_counter()
+            status = call()
+            latencies.append(time.perf_counter() - t0)
+            errors += status >= 400
+        return summarize(latencies, time.perf_counter() - started, errors)
+
+    results = {
+        "index": measure(lambda: client.get("/").status_code, requests),
+        "view_paste": measure(
+            lambda: client.get(f"/paste/{rng.choice(sample_ids)}").status_code,
+            requests,
+        ),
+    }
+
+    def create_then_view(size, count):
+        content = make_content(size, rng)
+        created = []
+
+        def create():
+            response = client.post("/paste", data={"content": content})
+            created.append(response.headers["Location"].rsplit("/", 1)[-1])
+            return response.status_code
+
+        return (
+            measure(create, count),
+            measure(
+                lambda: client.get(f"/paste/{rng.choice(created)}").status_code, count
+            ),
+        )
+
+    for size in sizes:
+        count = max(1, requests // max(1, size // 10_000))
+        create_stats, view_stats = create_then_view(size, count)
+        results[f"create_paste[{size}]"] = create_stats
+        results[f"view_paste[{size}]"] = view_stats
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(variant, db_path, workers):
+    """Launch serve.py for a variant and wait until it accepts connections."""
+    port = free_port()
+    env = dict(os.environ, PASTE_DB_PATH=db_path)
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "serve.py",
+            variant,
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"serve.py {variant} did not start")
+
+
+def load(port, make_request, requests, concurrency):
+    """Closed-loop load: ``concurrency`` threads share ``requests`` requests."""
+    latencies, errors = [], [0]
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            method, path, body, headers = make_request()
+            t0 = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                failed = True
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+
+def run_server_case(
+    variant, db_path, sample_ids, sizes, requests, seed, workers, concurrency
+):
+    """Benchmark one app served by gunicorn over real HTTP."""
+    rng = random.Random(seed)
+    process, port = start_server(variant, db_path, workers)
+    form = {"Content-Type": "application/x-www-form-urlencoded"}
+    try:
+        results = {
+            "index": load(port, lambda: ("GET", "/", None, {}), requests, concurrency),
+            "view_paste": load(
+                port,
+                lambda: ("GET", f"/paste/{rng.choice(sample_ids)}", None, {}),
+                requests,
+                concurrency,
+            ),
+        }
+        for size in sizes:
+            body = urlencode({"content": make_content(size, rng)})
+            count = max(1, requests // max(1, size // 10_000))
+            results[f"create_paste[{size}]"] = load(
+                port,
+                lambda body=body: ("POST", "/paste", body, form),
+                count,
+                concurrency,
+            )
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a message for every case that regressed against the baseline."""
+    regressions = []
+    for case, stats in results.items():
+        base = baseline.get(case)
+        if not base:
+            continue
+        if stats["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(
+                f"{case}: p95 {stats['p95_ms']:.2f}ms vs baseline {base['p95_ms']:.2f}ms"
+            )
+        if stats["throughput"] < base["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{case}: {stats['throughput']:.1f} req/s vs baseline {base['throughput']:.1f} req/s"
+            )
+    return regressions
+
+
+def environment():
+    """Describe the machine and revision the numbers came from."""
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "revision": revision,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the paste apps and compare against a stored baseline."
+    )
+    parser.add_argument(
+        "--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS)
+    )
+    parser.add_argument("--rows", nargs="+", type=int, default=list(DEFAULT_ROWS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument("--mode", choices=("client", "server", "both"), default="both")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument(
+        "--cache-size", help="PASTE_CACHE_SIZE for the apps (default: their own)"
+    )
+    parser.add_argument(
+        "--output", help="Results file (default: bench_results/<time>.json)"
+    )
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Allowed slowdown before a case counts as a regression (0.10 = 10%%)",
+    )
+    args = parser.parse_args()
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if args.cache_size is not None:
+        os.environ["PASTE_CACHE_SIZE"] = args.cache_size
+    modes = ("client", "server") if args.mode == "both" else (args.mode,)
+    spawn = multiprocessing.get_context("spawn")
+    results = {}
+
+    for rows in args.rows:
+        # All variants share one schema, so each size is seeded once
+        db_path = os.path.join(DATA_DIR, f"rows-{rows}.db")
+        print(f"Preparing {db_path}", file=sys.stderr)
+        rng = random.Random(args.seed)
+        seed.seed(db_path, rows, rng)
+        sample_ids = seed.sample_ids(db_path, rows, rng, SAMPLE_IDS)
+        for variant in args.variants:
+            for mode in modes:
+                print(f"Running {mode}/{variant}/rows={rows}", file=sys.stderr)
+                with scratch_copy(db_path) as case_db:
+                    if mode == "client":
+                        with spawn.Pool(1) as pool:
+                            cases = pool.apply(
+                                run_client_case,
+                                (
+                                    variant,
+                                    case_db,
+                                    sample_ids,
+                                    args.sizes,
+                                    args.requests,
+                                    args.seed,
+                                ),
+                            )
+                    else:
+                        cases = run_server_case(
+                            variant,
+                            case_db,
+                            sample_ids,
+                            args.sizes,
+                            args.requests,
+                            args.seed,
+                            args.workers,
+                            args.concurrency,
+                        )
+                for op, stats in cases.items():
+                    results[f"{mode}/{variant}/rows={rows}/{op}"] = stats
+
+    report = {"environment": environment(), "arguments": vars(args), "results": results}
+    output = args.output or os.path.join(
+        RESULTS_DIR, time.strftime("%Y%m%dT%H%M%S.json", time.gmtime())
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'case':<60} {'req/s':>10} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for case, stats in results.items():
+        print(
+            f"{case:<60} {stats['throughput']:>10.1f} {stats['p50_ms']:>8.2f}ms "
+            f"{stats['p95_ms']:>8.2f}ms {stats['p99_ms']:>8.2f}ms"
+        )
+    print(f"Results written to {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import json
+import zlib
+from difflib import SequenceMatcher, unified_diff
+
+# Bodies longer than this are not diffed for display; it runs on the request
+# thread, and its cost grows faster than the paste
+DIFF_MAX_LINES = 5000
+
+
+def make_delta(old, new):
+    """Encode ``new`` as line-level edits against ``old``.
+
+    The delta is a zlib-compressed JSON list in which ``[i, j]`` copies
+    lines ``i:j`` of ``old`` and a string inserts new text, so its size
+    tracks the size of the change rather than of the paste.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = SequenceMatcher(None, old_lines, new_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(new_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode())
+
+
+def apply_delta(old, delta):
+    """Rebuild the text a delta from make_delta() was made for."""
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    for op in json.loads(zlib.decompress(delta)):
+        parts.append("".join(old_lines[op[0] : op[1]]) if isinstance(op, list) else op)
+    return "".join(parts)
+
+
+def diff_lines(
+    old, new, old_name="parent", new_name="revision", max_lines=DIFF_MAX_LINES
+):
+    """Return a unified diff between two paste bodies.
+
+    Returns None, without diffing, if either has more than ``max_lines``
+    lines.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    if max(len(old_lines), len(new_lines)) > max_lines:
+        return None
+    return "".join(
+        unified_diff(old_lines, new_lines, fromfile=old_name, tofile=new_name)
+    )
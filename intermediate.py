@@ -1,28 +1,42 @@
 import os
 import secrets
-import sqlite3
 
-from flask import Flask, flash, redirect, render_template, request, url_for
+from flask import Flask, flash, g, redirect, render_template, request, url_for
+
+import backup
+import metrics
+import passwords
+import profiling
+import ratelimit
+import timing
+import upload
+from storage import create_storage
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)  # For flash messages
-DB_PATH = "pastes_intermediate.db"
+# Signs flash messages and unlock cookies; set it when workers are not forked
+# from one preloaded app, so they all accept each other's cookies
+app.secret_key = os.environ.get("PASTE_SECRET_KEY") or secrets.token_hex(16)
+app.config["PASTE_STORAGE"] = os.environ.get("PASTE_STORAGE", "sqlite")
+app.config["PASTE_CACHE_SIZE"] = int(os.environ.get("PASTE_CACHE_SIZE", "1024"))
+# Largest accepted request body, for form posts and raw uploads alike
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("PASTE_MAX_BYTES", "2097152"))
+app.config["MAX_FORM_MEMORY_SIZE"] = app.config["MAX_CONTENT_LENGTH"]
+DB_PATH = os.environ.get("PASTE_DB_PATH", "pastes_intermediate.db")
+
+storage = create_storage(
+    app.config["PASTE_STORAGE"], DB_PATH, cache_size=app.config["PASTE_CACHE_SIZE"]
+)
+if storage.db_path:
+    backup.init_app(app, storage.db_path)
+metrics.init_app(app, storage)
+profiling.init_app(app)
+timing.init_app(app, storage)
+ratelimit.init_app(app)
 
 
 def init_db():
-    """Initialize the SQLite database with the pastes table."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS pastes (
-            id TEXT PRIMARY KEY,
-            content TEXT NOT NULL,
-            title TEXT,
-            language TEXT DEFAULT 'plaintext',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            password TEXT
-        )
-        """)
+    """Initialize the paste storage."""
+    storage.init_db()
 
 
 def generate_paste_id(length=8):
@@ -30,18 +44,13 @@ def generate_paste_id(length=8):
     return secrets.token_urlsafe(length)[:length]
 
 
+upload.init_app(app, storage, generate_paste_id)
+
+
 @app.route("/")
 def index():
     """Display the home page with recent pastes."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute("""
-        SELECT id, title, created_at 
-        FROM pastes 
-        WHERE expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP 
-        ORDER BY created_at DESC 
-        LIMIT 10
-        """)
-        recent_pastes = cursor.fetchall()
+    recent_pastes = storage.recent(10)
     return render_template("index.html", recent_pastes=recent_pastes)
 
 
@@ -50,20 +59,19 @@ def create_paste():
     """Create a new paste."""
     content = request.form.get("content")
     title = request.form.get("title", "Untitled")
-    password = request.form.get("password")
+    password = request.form.get("password") or None
     language = request.form.get("language", "plaintext")
 
     if not content:
         flash("Paste content cannot be empty!", "error")
         return redirect(url_for("index"))
 
-    paste_id = generate_paste_id()
+    if password:
+        password = passwords.hash_password(password)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            "INSERT INTO pastes (id, content, title, password, language) VALUES (?, ?, ?, ?, ?)",
-            (paste_id, content, title, password, language),
-        )
+    paste_id = generate_paste_id()
+    g.paste_id = paste_id  # For the access log
+    storage.create(paste_id, content, title=title, password=password, language=language)
 
     flash("Paste created successfully!", "success")
     return redirect(url_for("view_paste", paste_id=paste_id))
@@ -72,28 +80,45 @@ def create_paste():
 @app.route("/paste/<paste_id>")
 def view_paste(paste_id):
     """View a specific paste."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute(
-            "SELECT content, title, created_at, password, language FROM pastes WHERE id = ?",
-            (paste_id,),
-        )
-        paste = cursor.fetchone()
+    paste = storage.get(paste_id)
 
     if not paste:
         flash("Paste not found!", "error")
         return redirect(url_for("index"))
 
-    content, title, created_at, has_password, language = paste
-    if has_password and request.args.get("password") != has_password:
+    if paste.password and not passwords.is_unlocked(paste_id):
         return render_template("password.html", paste_id=paste_id)
 
     return render_template(
         "view.html",
-        content=content,
-        title=title,
-        created_at=created_at,
+        content=paste.content,
+        title=paste.title,
+        created_at=paste.created_at,
         paste_id=paste_id,
-        language=language,
+        language=paste.language,
+    )
+
+
+@app.route("/paste/<paste_id>/unlock", methods=["POST"])
+def unlock_paste(paste_id):
+    """Check a paste's password once and remember the unlock in a signed cookie."""
+    paste = storage.get(paste_id, content=False)
+
+    if not paste:
+        flash("Paste not found!", "error")
+        return redirect(url_for("index"))
+
+    if paste.password and not passwords.check_password(
+        paste.password, request.form.get("password")
+    ):
+        flash("Incorrect password!", "error")
+        return render_template("password.html", paste_id=paste_id), 403
+
+    if paste.password:
+        passwords.upgrade(storage, paste, request.form.get("password"))
+
+    return passwords.unlock(
+        redirect(url_for("view_paste", paste_id=paste_id)), paste_id
     )
 
 
@@ -251,7 +276,7 @@ password_html = """
 <div class="row">
     <div class="col-md-6 offset-md-3">
         <h2>Password Protected Paste</h2>
-        <form method="GET">
+        <form method="POST" action="{{ url_for('unlock_paste', paste_id=paste_id) }}">
             <div class="mb-3">
                 <label for="password" class="form-label">Enter Password</label>
                 <input type="password" class="form-control" id="password" name="password" required>
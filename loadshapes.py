@@ -0,0 +1,211 @@
+import json
+import logging
+from collections import namedtuple
+
+from locust import LoadTestShape, events
+from locust.stats import calculate_response_time_percentile
+
+logger = logging.getLogger(__name__)
+
+Stage = namedtuple("Stage", "name duration users")
+
+
+@events.init_command_line_parser.add_listener
+def add_shape_arguments(parser):
+    parser.add_argument(
+        "--shape",
+        choices=("step", "spike", "soak"),
+        default="step",
+        help="step: ramp in equal steps; spike: base, burst, base; soak: hold",
+    )
+    parser.add_argument("--step-users", type=int, default=10)
+    parser.add_argument("--step-time", type=int, default=30, help="Seconds per stage")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--spike-users", type=int, default=100)
+    parser.add_argument("--spike-time", type=int, default=30)
+    parser.add_argument("--soak-users", type=int, default=50)
+    parser.add_argument("--soak-time", type=int, default=3600)
+    parser.add_argument(
+        "--knee-latency-factor",
+        type=float,
+        default=2.0,
+        help="A stage is past the knee once its p95 exceeds the first stage's by this factor",
+    )
+    parser.add_argument(
+        "--knee-efficiency",
+        type=float,
+        default=0.8,
+        help="...or its requests per user drop below this share of the first stage's",
+    )
+    parser.add_argument(
+        "--knee-error-rate",
+        type=float,
+        default=0.01,
+        help="...or more than this fraction of its requests fail",
+    )
+    parser.add_argument("--shape-report", default="", help="Write stage results here")
+    parser.add_argument(
+        "--shape-label",
+        default="",
+        help="Recorded in the report, e.g. the variant and worker count",
+    )
+
+
+def build_stages(options):
+    """Turn the shape options into a list of Stages."""
+    if options.shape == "spike":
+        return [
+            Stage("base", options.step_time, options.step_users),
+            Stage("spike", options.spike_time, options.spike_users),
+            Stage("recovery", options.step_time, options.step_users),
+        ]
+    if options.shape == "soak":
+        # Split into step_time stages so drift over the run shows up
+        count = max(1, options.soak_time // options.step_time)
+        return [
+            Stage(f"soak {i + 1}", options.step_time, options.soak_users)
+            for i in range(count)
+        ]
+    return [
+        Stage(f"step {i + 1}", options.step_time, options.step_users * (i + 1))
+        for i in range(options.steps)
+    ]
+
+
+def snapshot(stats):
+    total = stats.total
+    return (
+        total.num_requests - total.num_none_requests,
+        total.num_failures,
+        dict(total.response_times),
+    )
+
+
+def stage_result(stage, before, after, elapsed):
+    """Summarise the requests made between two snapshots."""
+    requests = after[0] - before[0]
+    failures = after[1] - before[1]
+    times = {
+        key: count - before[2].get(key, 0)
+        for key, count in after[2].items()
+        if count != before[2].get(key, 0)
+    }
+    return {
+        "stage": stage.name,
+        "users": stage.users,
+        "requests": requests,
+        "rps": requests / elapsed if elapsed else 0.0,
+        "p50_ms": calculate_response_time_percentile(times, requests, 0.50),
+        "p95_ms": calculate_response_time_percentile(times, requests, 0.95),
+        "error_rate": failures / requests if requests else 0.0,
+    }
+
+
+def find_knee(results, options):
+    """Return the index of the first stage past the knee, or None.
+
+    Each stage is compared with the best seen before it, so a noisy first
+    stage does not hide or fake a knee. A stage is past the knee when its
+    p95 has grown by ``--knee-latency-factor``, its throughput per user has
+    fallen below ``--knee-efficiency`` of the best (users are queueing
+    rather than being served), or its error rate is over the limit.
+    """
+    best_p95 = best_efficiency = None
+    for index, result in enumerate(results):
+        if not result["requests"]:
+            continue
+        efficiency = result["rps"] / result["users"]
+        if result["error_rate"] > options.knee_error_rate:
+            return index
+        if best_p95 is not None and (
+            result["p95_ms"] > max(best_p95, 1) * options.knee_latency_factor
+            or efficiency < best_efficiency * options.knee_efficiency
+        ):
+            return index
+        best_p95 = (
+            result["p95_ms"] if best_p95 is None else min(best_p95, result["p95_ms"])
+        )
+        best_efficiency = max(best_efficiency or 0.0, efficiency)
+    return None
+
+
+class PasteLoadShape(LoadTestShape):
+    """Run the stages picked by ``--shape`` and report the knee.
+
+    Load this file next to the scenarios, e.g.
+    ``locust -f locustfile.py,loadshapes.py --headless --shape step``. Each
+    stage holds a fixed user count; when it ends, its throughput, p95 and
+    error rate are recorded. After the last stage the knee, where latency
+    diverges, is logged and written to ``--shape-report``.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stages = None
+        self.results = []
+        self.current = 0
+        self.stage_started = 0.0
+        self.before = None
+
+    def tick(self):
+        options = self.runner.environment.parsed_options
+        if self.stages is None:
+            self.stages = build_stages(options)
+            self.before = snapshot(self.runner.stats)
+
+        run_time = self.get_run_time()
+        stage = self.stages[self.current]
+        if run_time - self.stage_started >= stage.duration:
+            after = snapshot(self.runner.stats)
+            self.results.append(
+                stage_result(stage, self.before, after, run_time - self.stage_started)
+            )
+            logger.info(
+                "Stage %(stage)s: %(users)d users, %(rps).1f req/s, "
+                "p95 %(p95_ms)dms, error rate %(error_rate).3f",
+                self.results[-1],
+            )
+            self.before = after
+            self.stage_started = run_time
+            self.current += 1
+            if self.current == len(self.stages):
+                self.report(options)
+                return None
+            stage = self.stages[self.current]
+
+        # Reach each stage's user count, up or down, within about a second
+        return stage.users, max(abs(stage.users - self.get_current_user_count()), 1)
+
+    def report(self, options):
+        knee = find_knee(self.results, options)
+        if knee is None:
+            logger.info(
+                "No knee: latency held up through %d users",
+                max(result["users"] for result in self.results),
+            )
+        elif knee == 0:
+            logger.warning("Already saturated at the first stage")
+        else:
+            logger.warning(
+                "Knee between %d users (%.1f req/s, p95 %dms) and %d users "
+                "(%.1f req/s, p95 %dms)",
+                self.results[knee - 1]["users"],
+                self.results[knee - 1]["rps"],
+                self.results[knee - 1]["p95_ms"],
+                self.results[knee]["users"],
+                self.results[knee]["rps"],
+                self.results[knee]["p95_ms"],
+            )
+        if options.shape_report:
+            with open(options.shape_report, "w") as f:
+                json.dump(
+                    {
+                        "label": options.shape_label,
+                        "shape": options.shape,
+                        "stages": self.results,
+                        "knee": None if knee is None else self.results[knee]["stage"],
+                        "capacity": self.results[knee - 1] if knee else None,
+                    },
+                    f,
+                    indent=2,
+                )
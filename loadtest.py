@@ -0,0 +1,145 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark import VARIANTS, start_server
+
+RESULTS_DIR = "loadtest_results"
+
+
+def locust_command(args, host, prefix, extra):
+    """Build the headless locust invocation for one run.
+
+    ``extra`` holds any options loadtest.py does not know itself, such as
+    ``--read-distribution``; they are handed to locust unchanged.
+    """
+    locustfiles = ["openmodel.py" if args.open_model else "locustfile.py"]
+    if args.shape:
+        locustfiles.append("loadshapes.py")
+    command = [
+        sys.executable,
+        "-m",
+        "locust",
+        "-f",
+        ",".join(locustfiles),
+        "--headless",
+        "--host",
+        host,
+        "--csv",
+        prefix,
+        "--results-json",
+        f"{prefix}.json",
+        "--only-summary",
+        *extra,
+        *args.user_classes,
+    ]
+    if args.shape:
+        # The shape decides user counts and when the run ends
+        command += [
+            "--shape",
+            args.shape,
+            "--shape-report",
+            f"{prefix}_shape.json",
+            "--shape-label",
+            f"{args.variant} workers={args.workers}",
+        ]
+    else:
+        command += [
+            "--users",
+            str(args.users),
+            "--spawn-rate",
+            str(args.spawn_rate),
+            "--run-time",
+            args.run_time,
+        ]
+    if args.id_manifest:
+        command += ["--id-manifest", args.id_manifest]
+    if args.slo_p95:
+        command += ["--slo-p95", args.slo_p95]
+    if args.slo_error_rate is not None:
+        command += ["--slo-error-rate", str(args.slo_error_rate)]
+    if args.slo_min_rps is not None:
+        command += ["--slo-min-rps", str(args.slo_min_rps)]
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the locust scenarios headless against one app variant "
+        "and fail when the SLOs are not met. Unrecognised options are passed "
+        "on to locust."
+    )
+    parser.add_argument("variant", choices=VARIANTS, help="Which app to test")
+    parser.add_argument(
+        "--host", help="Test an already running server instead of starting one"
+    )
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--spawn-rate", type=float, default=5)
+    parser.add_argument("--run-time", default="1m")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--db", help="Serve this database, e.g. one filled by seed.py (default: empty)"
+    )
+    parser.add_argument("--id-manifest", help="Seeded ids for users to read")
+    parser.add_argument(
+        "--shape",
+        choices=("step", "spike", "soak"),
+        help="Drive the run with a load shape from loadshapes.py and report its knee",
+    )
+    parser.add_argument(
+        "--open-model",
+        action="store_true",
+        help="Start requests at a fixed rate (openmodel.py) instead of per user",
+    )
+    parser.add_argument(
+        "--user-classes",
+        nargs="+",
+        help="Locust user classes to run (default: PastebinUser and "
+        "PastebinAdminUser, or ArrivalUser with --open-model)",
+    )
+    parser.add_argument(
+        "--slo-p95",
+        default="Aggregated=500",
+        help="Per-endpoint p95 limits in ms ('name=ms,...', 'Aggregated' for all)",
+    )
+    parser.add_argument("--slo-error-rate", type=float, default=0.01)
+    parser.add_argument("--slo-min-rps", type=float)
+    parser.add_argument("--output", default=RESULTS_DIR)
+    args, extra = parser.parse_known_args()
+    if not args.user_classes:
+        args.user_classes = (
+            ["ArrivalUser"]
+            if args.open_model
+            else ["PastebinUser", "PastebinAdminUser"]
+        )
+
+    os.makedirs(args.output, exist_ok=True)
+    prefix = os.path.join(args.output, args.variant)
+
+    server = None
+    host = args.host
+    if host is None:
+        db_path = args.db or os.path.join(
+            tempfile.mkdtemp(prefix="paste-loadtest-"), "pastes.db"
+        )
+        server, port = start_server(args.variant, db_path, args.workers)
+        host = f"http://127.0.0.1:{port}"
+
+    try:
+        code = subprocess.call(locust_command(args, host, prefix, extra))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"Results in {prefix}_stats.csv and {prefix}.json")
+    if args.shape:
+        print(f"Stage results and knee in {prefix}_shape.json")
+    print("SLOs passed" if code == 0 else "SLOs FAILED")
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
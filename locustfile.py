@@ -1,7 +1,309 @@
+import json
+import logging
+import math
 import random
 import string
 
-from locust import HttpUser, between, task
+import gevent
+from locust import HttpUser, between, events, task
+from locust.runners import MasterRunner, WorkerRunner
+
+logger = logging.getLogger(__name__)
+
+# Tasks that create pastes; every other task is a read
+WRITE_TASKS = {"create_paste", "create_large_paste", "upload_large_paste"}
+
+
+@events.init_command_line_parser.add_listener
+def add_slo_arguments(parser):
+    """SLOs checked when a run ends; any violation makes locust exit non-zero."""
+    parser.add_argument(
+        "--slo-p95",
+        default="",
+        help="Per-endpoint p95 limits in ms, e.g. '/=100,/paste/[id]=150,Aggregated=200'",
+    )
+    parser.add_argument(
+        "--slo-error-rate",
+        type=float,
+        default=None,
+        help="Maximum fraction of failed requests, e.g. 0.01",
+    )
+    parser.add_argument(
+        "--slo-min-rps",
+        type=float,
+        default=None,
+        help="Minimum overall requests per second",
+    )
+    parser.add_argument(
+        "--id-manifest",
+        default="",
+        help="File of seeded paste ids (from seed.py) for users to read",
+    )
+    parser.add_argument(
+        "--read-distribution",
+        choices=("uniform", "zipf", "hotset"),
+        default="zipf",
+        help="How paste views are spread over known ids",
+    )
+    parser.add_argument(
+        "--zipf-s",
+        type=float,
+        default=1.1,
+        help="Zipf exponent; higher concentrates more reads on the top ids",
+    )
+    parser.add_argument(
+        "--hot-fraction",
+        type=float,
+        default=0.01,
+        help="hotset: fraction of ids that are hot",
+    )
+    parser.add_argument(
+        "--hot-share",
+        type=float,
+        default=0.9,
+        help="hotset: fraction of views that go to hot ids",
+    )
+    parser.add_argument(
+        "--popularity-seed",
+        type=int,
+        default=1234,
+        help="Seed for ranking seeded ids; keep it equal on all workers",
+    )
+    parser.add_argument(
+        "--read-write-ratio",
+        default="",
+        help="Reads per write, e.g. '9:1'; default keeps the task weights",
+    )
+    parser.add_argument(
+        "--results-json",
+        default="",
+        help="Write per-endpoint stats and SLO results to this file",
+    )
+
+
+def parse_p95_limits(spec):
+    """Parse 'name=ms,name=ms' into a dict of endpoint name to milliseconds."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, limit = item.rpartition("=")
+        limits[name] = float(limit)
+    return limits
+
+
+def check_slos(stats, options):
+    """Return a message for every SLO the run's stats violate."""
+    violations = []
+    entries = {entry.name: entry for entry in stats.entries.values()}
+    entries[stats.total.name] = stats.total
+    for name, limit in parse_p95_limits(options.slo_p95).items():
+        entry = entries.get(name)
+        if entry is None or not entry.num_requests:
+            violations.append(f"p95 SLO for {name!r}: no requests recorded")
+            continue
+        p95 = entry.get_response_time_percentile(0.95)
+        if p95 > limit:
+            violations.append(f"p95 of {name!r} is {p95:.0f}ms, limit {limit:.0f}ms")
+    if (
+        options.slo_error_rate is not None
+        and stats.total.fail_ratio > options.slo_error_rate
+    ):
+        violations.append(
+            f"error rate is {stats.total.fail_ratio:.2%}, limit {options.slo_error_rate:.2%}"
+        )
+    if options.slo_min_rps is not None and stats.total.total_rps < options.slo_min_rps:
+        violations.append(
+            f"throughput is {stats.total.total_rps:.1f} req/s, minimum {options.slo_min_rps:.1f}"
+        )
+    return violations
+
+
+def summarize_entry(entry):
+    return {
+        "method": entry.method,
+        "name": entry.name,
+        "requests": entry.num_requests,
+        "failures": entry.num_failures,
+        "rps": entry.total_rps,
+        "avg_ms": entry.avg_response_time,
+        "p50_ms": entry.get_response_time_percentile(0.50),
+        "p95_ms": entry.get_response_time_percentile(0.95),
+        "p99_ms": entry.get_response_time_percentile(0.99),
+    }
+
+
+@events.quitting.add_listener
+def enforce_slos(environment, **kwargs):
+    """Check SLOs once the run is over and record the outcome."""
+    options = environment.parsed_options
+    if options is None or isinstance(environment.runner, WorkerRunner):
+        # Workers only report to the master, which sees the merged stats
+        return
+
+    stats = environment.stats
+    violations = check_slos(stats, options)
+    for message in violations:
+        logger.error("SLO violated: %s", message)
+    if violations:
+        environment.process_exit_code = 1
+
+    if options.results_json:
+        with open(options.results_json, "w") as f:
+            json.dump(
+                {
+                    "endpoints": [summarize_entry(e) for e in stats.entries.values()],
+                    "total": summarize_entry(stats.total),
+                    "slo_violations": violations,
+                    "passed": not violations,
+                },
+                f,
+                indent=2,
+            )
+
+
+class PastePool:
+    """Paste ids that every user in this process reads from.
+
+    Ids are ranked by popularity in the order they were added, and ``pick``
+    draws a rank from the configured distribution. Zipf ranks come from the
+    continuous approximation of its inverse CDF, so the pool can keep
+    growing without rebuilding a weight table.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.manifest = None  # Path of the id manifest already loaded
+        self.shared = False  # Whether created ids go out to other workers
+        self.pending = []  # Created here, not yet sent out
+        self.distribution = "zipf"
+        self.zipf_s = 1.1
+        self.hot_fraction = 0.01
+        self.hot_share = 0.9
+
+    def configure(self, options):
+        self.distribution = options.read_distribution
+        self.zipf_s = options.zipf_s
+        self.hot_fraction = options.hot_fraction
+        self.hot_share = options.hot_share
+
+    def extend(self, ids):
+        self.ids.extend(ids)
+
+    def add_created(self, paste_id):
+        self.ids.append(paste_id)
+        if self.shared:
+            self.pending.append(paste_id)
+
+    def pick(self):
+        """Return an id drawn from the distribution, or None if there are none."""
+        count = len(self.ids)
+        if not count:
+            return None
+        if self.distribution == "zipf":
+            rank = self._zipf_rank(count)
+        elif self.distribution == "hotset":
+            hot = max(1, math.ceil(count * self.hot_fraction))
+            if hot == count or random.random() < self.hot_share:
+                rank = random.randrange(hot)
+            else:
+                rank = random.randrange(hot, count)
+        else:
+            rank = random.randrange(count)
+        return self.ids[rank]
+
+    def _zipf_rank(self, count):
+        u = random.random()
+        s = self.zipf_s
+        if s == 1:
+            x = count**u
+        else:
+            x = ((count ** (1 - s) - 1) * u + 1) ** (1 / (1 - s))
+        return min(int(x) - 1, count - 1)
+
+
+pool = PastePool()
+
+
+def apply_read_write_ratio(user_class, ratio):
+    """Rescale a user class's task weights to ``reads:writes``.
+
+    Reads keep their weights relative to each other, as do writes.
+    """
+    reads, _, writes = ratio.partition(":")
+    reads, writes = int(reads), int(writes or 1)
+    weights = {}
+    for func in dict.fromkeys(user_class.tasks):
+        weights[func] = user_class.tasks.count(func)
+    read_total = sum(w for f, w in weights.items() if f.__name__ not in WRITE_TASKS)
+    write_total = sum(w for f, w in weights.items() if f.__name__ in WRITE_TASKS)
+    if not read_total or not write_total:
+        return
+    for func, weight in weights.items():
+        if func.__name__ in WRITE_TASKS:
+            weights[func] = weight * read_total * writes
+        else:
+            weights[func] = weight * write_total * reads
+    divisor = math.gcd(*weights.values())
+    user_class.tasks = [
+        func for func, weight in weights.items() for _ in range(weight // divisor)
+    ]
+
+
+def share_created_ids(environment):
+    """Send ids created on this worker to the master once a second."""
+    while True:
+        gevent.sleep(1)
+        if pool.pending:
+            ids, pool.pending = pool.pending, []
+            environment.runner.send_message("paste_ids", ids)
+
+
+@events.init.add_listener
+def share_pool(environment, **kwargs):
+    """Keep the id pools of distributed workers in step.
+
+    Workers forward the ids their users create to the master, which relays
+    them to every other worker, so all workers read from the same pool.
+    """
+    runner = environment.runner
+    if isinstance(runner, MasterRunner):
+
+        def relay(msg, **kwargs):
+            for client in runner.clients.all:
+                if client.id != msg.node_id:
+                    runner.send_message("paste_ids", msg.data, client_id=client.id)
+
+        runner.register_message("paste_ids", relay)
+    elif isinstance(runner, WorkerRunner):
+        pool.shared = True
+        runner.register_message(
+            "paste_ids", lambda msg, **kwargs: pool.extend(msg.data)
+        )
+        gevent.spawn(share_created_ids, environment)
+
+
+@events.test_start.add_listener
+def setup_pool(environment, **kwargs):
+    """Apply the read options and fill the pool from the id manifest.
+
+    This waits for test_start because workers only receive the master's
+    options when it tells them to spawn users.
+    """
+    options = environment.parsed_options
+    if options is None or isinstance(environment.runner, MasterRunner):
+        return
+    pool.configure(options)
+    if options.read_write_ratio:
+        for user_class in environment.user_classes:
+            apply_read_write_ratio(user_class, options.read_write_ratio)
+
+    if options.id_manifest and options.id_manifest != pool.manifest:
+        with open(options.id_manifest) as f:
+            ids = [line.strip() for line in f if line.strip()]
+        # Every worker shuffles with the same seed, so they agree on which
+        # ids are the popular ones
+        random.Random(options.popularity_seed).shuffle(ids)
+        pool.extend(ids)
+        pool.manifest = options.id_manifest
 
 
 class PastebinUser(HttpUser):
@@ -10,7 +312,6 @@ class PastebinUser(HttpUser):
 
     def on_start(self):
         """Initialize user's session data."""
-        self.paste_ids = []  # Store created paste IDs
         self.sample_content = [
             "print('Hello, World!')",
             "def fibonacci(n):\n    if n <= 1:\n        return n\n    return fibonacci(n-1) + fibonacci(n-2)",
@@ -41,7 +342,7 @@ class PastebinUser(HttpUser):
     @task(3)  # Higher weight for viewing home page
     def view_home_page(self):
         """Test accessing the home page."""
-        with self.client.get("/", catch_response=True) as response:
+        with self.client.get("/", name="/", catch_response=True) as response:
             if response.status_code != 200:
                 response.failure(f"Home page failed with status {response.status_code}")
 
@@ -62,11 +363,20 @@ class PastebinUser(HttpUser):
         if random.random() < 0.2:  # 20% chance of password protection
             data["password"] = "test123"
 
-        with self.client.post("/paste", data=data, catch_response=True) as response:
+        with self.client.post(
+            "/paste",
+            data=data,
+            name="/paste",
+            allow_redirects=False,
+            catch_response=True,
+        ) as response:
             if response.status_code == 302:  # Successful redirect
                 # Extract paste ID from redirect URL
                 paste_id = response.headers["Location"].split("/")[-1]
-                self.paste_ids.append(paste_id)
+                # Reads of protected pastes would time the password form, so
+                # like seed.sample_ids they are kept out of the shared pool
+                if "password" not in data:
+                    pool.add_created(paste_id)
             else:
                 response.failure(
                     f"Paste creation failed with status {response.status_code}"
@@ -75,10 +385,12 @@ class PastebinUser(HttpUser):
     @task(4)  # Higher weight for viewing pastes
     def view_paste(self):
         """Test viewing existing pastes."""
-        if self.paste_ids:
-            # View a previously created paste
-            paste_id = random.choice(self.paste_ids)
-            with self.client.get(f"/paste/{paste_id}", catch_response=True) as response:
+        paste_id = pool.pick()
+        if paste_id:
+            # View a seeded or previously created paste, skewed by popularity
+            with self.client.get(
+                f"/paste/{paste_id}", name="/paste/[id]", catch_response=True
+            ) as response:
                 if response.status_code != 200:
                     response.failure(
                         f"Paste view failed with status {response.status_code}"
@@ -91,7 +403,12 @@ class PastebinUser(HttpUser):
     def view_nonexistent_paste(self):
         """Test viewing a non-existent paste."""
         fake_id = "".join(random.choices(string.ascii_letters + string.digits, k=8))
-        with self.client.get(f"/paste/{fake_id}", catch_response=True) as response:
+        with self.client.get(
+            f"/paste/{fake_id}",
+            name="/paste/[missing]",
+            allow_redirects=False,
+            catch_response=True,
+        ) as response:
             if response.status_code not in [
                 302,
                 404,
@@ -113,15 +430,40 @@ class PastebinAdminUser(PastebinUser):
             "language": random.choice(self.languages),
         }
 
-        with self.client.post("/paste", data=data, catch_response=True) as response:
+        with self.client.post(
+            "/paste",
+            data=data,
+            name="/paste [large]",
+            allow_redirects=False,
+            catch_response=True,
+        ) as response:
             if response.status_code == 302:
                 paste_id = response.headers["Location"].split("/")[-1]
-                self.paste_ids.append(paste_id)
+                pool.add_created(paste_id)
             else:
                 response.failure(
                     f"Large paste creation failed with status {response.status_code}"
                 )
 
+    @task(1)
+    def upload_large_paste(self):
+        """Test streaming a large paste as a raw request body."""
+        body = self.generate_random_string(100_000).encode()
+        with self.client.put(
+            "/paste/upload",
+            params={"title": f"Uploaded Paste {random.randint(1, 1000)}"},
+            data=body,
+            headers={"Content-Type": "text/plain"},
+            name="/paste/upload",
+            catch_response=True,
+        ) as response:
+            if response.status_code == 201:
+                pool.add_created(response.json()["id"])
+            else:
+                response.failure(
+                    f"Paste upload failed with status {response.status_code}"
+                )
+
 
 if __name__ == "__main__":
     # This section is for local testing without the Locust UI
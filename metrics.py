@@ -0,0 +1,106 @@
+import os
+
+from flask import Response, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+import timing
+
+# Under gunicorn, serve.py points PROMETHEUS_MULTIPROC_DIR at a directory
+# shared by all workers; prometheus_client then keeps every metric in
+# per-process mmap'd files there, and /metrics sums them on each scrape.
+# The variable must be set before this module is imported.
+MULTIPROC_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+REQUESTS = Counter(
+    "paste_requests_total",
+    "HTTP requests handled, by route and status.",
+    ["endpoint", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "paste_request_duration_seconds",
+    "Time from request start to response, by route.",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY = Histogram(
+    "paste_db_query_duration_seconds",
+    "Time spent in storage calls, by operation.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_LOCK_WAIT = Histogram(
+    "paste_db_lock_wait_seconds",
+    "Time spent waiting for SQLite's write lock.",
+    buckets=LATENCY_BUCKETS,
+)
+DB_BUSY = Counter(
+    "paste_db_busy_total",
+    "Storage calls that failed because the database was locked.",
+    ["operation"],
+)
+TEMPLATE_RENDER = Histogram(
+    "paste_template_render_seconds",
+    "Time spent rendering templates.",
+    ["template"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "paste_cache_requests_total",
+    "Paste cache lookups; hit ratio is rate(hit) / rate(all results).",
+    ["result"],
+)
+
+
+def observe_storage(event, operation=None, seconds=None, result=None):
+    """Storage listener that records its events as metrics."""
+    if event == "query":
+        DB_QUERY.labels(operation).observe(seconds)
+    elif event == "lock_wait":
+        DB_LOCK_WAIT.observe(seconds)
+    elif event == "busy":
+        DB_BUSY.labels(operation).inc()
+    elif event == "cache":
+        CACHE_REQUESTS.labels(result).inc()
+
+
+def collect():
+    """Render every metric in the Prometheus text format."""
+    if os.environ.get(MULTIPROC_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_app(app, storage):
+    """Instrument a paste app and its storage, and add a ``/metrics`` route.
+
+    Request and render timings come from the shared hooks in timing.py.
+    """
+    storage.add_listener(observe_storage)
+
+    def record_request(response, phases):
+        # Unmatched URLs share one label so 404 scans cannot add series
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.labels(endpoint).observe(phases["total"])
+        REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+        for template, seconds in phases["templates"]:
+            TEMPLATE_RENDER.labels(template).observe(seconds)
+
+    timing.instrument(app, storage).append(record_request)
+
+    @app.route("/metrics")
+    def metrics():
+        """Expose request, storage, render and cache metrics for Prometheus."""
+        return Response(collect(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,83 @@
+import random
+import time
+
+from gevent.pool import Pool
+from locust import events
+from urllib3 import PoolManager
+
+import locustfile
+
+
+@events.init_command_line_parser.add_listener
+def add_arrival_arguments(parser):
+    parser.add_argument(
+        "--arrival-rate",
+        type=float,
+        default=1.0,
+        help="Actions started per second by each ArrivalUser",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=100,
+        help="Per user; arrivals beyond this are dropped and counted as failures",
+    )
+
+
+@events.test_start.add_listener
+def apply_ratio(environment, **kwargs):
+    # Arrivals pick from PastebinUser's tasks, which is not itself running
+    options = environment.parsed_options
+    if options is not None and options.read_write_ratio:
+        locustfile.apply_read_write_ratio(
+            locustfile.PastebinUser, options.read_write_ratio
+        )
+
+
+class ArrivalUser(locustfile.PastebinUser):
+    """Open-model load: actions start on a fixed schedule.
+
+    A closed-model user waits for each response before its next request, so
+    a slow server quietly receives less load. Each ArrivalUser instead
+    starts one of PastebinUser's actions every ``1 / --arrival-rate``
+    seconds whether or not earlier ones have finished, so the total arrival
+    rate is users x rate. Combined with loadshapes.py, each step raises the
+    arrival rate. Arrivals that find ``--max-in-flight`` actions still
+    running are dropped and reported as failures, which is how saturation
+    shows up in an open model.
+    """
+
+    # Shared by all arrival users, sized for many concurrent requests
+    pool_manager = PoolManager(maxsize=1000)
+
+    def on_start(self):
+        super().on_start()
+        options = self.environment.parsed_options
+        self.interval = 1 / options.arrival_rate
+        self.in_flight = Pool(options.max_in_flight)
+        self.next_arrival = time.monotonic() + random.uniform(0, self.interval)
+
+    def on_stop(self):
+        self.in_flight.kill()
+
+    def wait_time(self):
+        return max(0.0, self.next_arrival - time.monotonic())
+
+    def arrive(self):
+        self.next_arrival += self.interval
+        if self.in_flight.full():
+            self.environment.events.request.fire(
+                request_type="ARRIVAL",
+                name="dropped",
+                response_time=0,
+                response_length=0,
+                exception=RuntimeError("max in-flight actions reached"),
+                context={},
+            )
+            return
+        action = random.choice(locustfile.PastebinUser.tasks)
+        self.in_flight.spawn(action, self)
+
+
+# Replaces the tasks inherited from PastebinUser, which arrive() runs itself
+ArrivalUser.tasks = [ArrivalUser.arrive]
@@ -0,0 +1,108 @@
+import argparse
+import hmac
+import os
+
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# How long one successful password check keeps a paste unlocked, in seconds
+UNLOCK_MAX_AGE = int(os.environ.get("PASTE_UNLOCK_MAX_AGE", "3600"))
+# Unlock cookies are only sent back to paste URLs, where they are checked
+UNLOCK_PATH = "/paste/"
+HASH_METHOD = "scrypt"
+
+
+def hash_password(password):
+    """Hash a paste password with scrypt and a random salt."""
+    return generate_password_hash(password, method=HASH_METHOD)
+
+
+def is_hashed(stored):
+    return stored.startswith(f"{HASH_METHOD}:")
+
+
+def check_password(stored, supplied):
+    """Check a supplied password against a stored hash.
+
+    Values that are not hashes are compared as plaintext, for rows written
+    before passwords were hashed and not migrated yet.
+    """
+    if not supplied:
+        return False
+    if is_hashed(stored):
+        return check_password_hash(stored, supplied)
+    # compare_digest only takes ASCII str, so compare the encoded bytes
+    return hmac.compare_digest(stored.encode(), supplied.encode())
+
+
+def upgrade(storage, paste, supplied):
+    """Store the hash of a plaintext password that ``supplied`` just matched.
+
+    Rows from before passwords were hashed are migrated on their first
+    unlock, unless ``python passwords.py`` got to them first.
+    """
+    if not is_hashed(paste.password):
+        storage.set_password(paste.id, paste.password, hash_password(supplied))
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt="paste-unlock")
+
+
+def unlock_cookie(paste_id):
+    return f"unlock_{paste_id}"
+
+
+def unlock(response, paste_id):
+    """Set a signed cookie that unlocks ``paste_id`` for UNLOCK_MAX_AGE.
+
+    Views check the signature instead of the password, so the slow KDF runs
+    once per unlock rather than on every view.
+    """
+    response.set_cookie(
+        unlock_cookie(paste_id),
+        _serializer().dumps(paste_id),
+        max_age=UNLOCK_MAX_AGE,
+        path=UNLOCK_PATH,
+        httponly=True,
+        samesite="Lax",
+    )
+    return response
+
+
+def is_unlocked(paste_id):
+    """Check whether the current request carries a valid unlock for ``paste_id``."""
+    token = request.cookies.get(unlock_cookie(paste_id))
+    if not token:
+        return False
+    try:
+        return _serializer().loads(token, max_age=UNLOCK_MAX_AGE) == paste_id
+    except BadSignature:
+        # Also covers SignatureExpired
+        return False
+
+
+def main():
+    # storage imports this module for hash_password
+    from storage import SQLiteStorage
+
+    parser = argparse.ArgumentParser(
+        description="Hash the plaintext passwords left in a paste database."
+    )
+    parser.add_argument("db_path", help="Path of the paste database")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    storage = SQLiteStorage(args.db_path)
+    storage.init_db()
+    hashed = storage.hash_passwords(
+        batch_size=args.batch_size,
+        progress=lambda done: print(f"\rHashed {done} passwords", end="", flush=True),
+    )
+    storage.close()
+    print(f"\rHashed {hashed} passwords")
+
+
+if __name__ == "__main__":
+    main()
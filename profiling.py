@@ -0,0 +1,149 @@
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from werkzeug.exceptions import HTTPException
+
+from admin import check_token
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+ADMIN_HEADER = "HTTP_X_ADMIN_TOKEN"
+
+
+class StackSampler(threading.Thread):
+    """Sample one thread's Python stack at a fixed interval.
+
+    Samples are kept as collapsed stacks (``outer;inner;leaf`` -> count),
+    the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+
+class SamplingProfiler:
+    """WSGI middleware that profiles a sample of requests.
+
+    A request is profiled when it wins the ``rate`` draw, or when it sends
+    ``X-Profile: 1`` along with a valid ``X-Admin-Token``. In ``cprofile``
+    mode a ``.prof`` pstats file is written per request; in ``stack`` mode a
+    ``.collapsed`` file of stack samples taken every ``interval`` seconds.
+    Only the newest ``max_files`` files are kept in ``output_dir``.
+    """
+
+    def __init__(
+        self,
+        wsgi_app,
+        url_map,
+        output_dir="profiles",
+        rate=0.0,
+        mode="cprofile",
+        interval=0.001,
+        max_files=200,
+    ):
+        if mode not in ("cprofile", "stack"):
+            raise ValueError(f"Unknown profiling mode {mode!r}")
+        self.wsgi_app = wsgi_app
+        self.url_map = url_map
+        self.output_dir = output_dir
+        self.rate = rate
+        self.mode = mode
+        self.interval = interval
+        self.max_files = max_files
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        flagged = environ.get(PROFILE_HEADER) == "1" and check_token(
+            environ.get(ADMIN_HEADER)
+        )
+        if not flagged and (not self.rate or random.random() >= self.rate):
+            return self.wsgi_app(environ, start_response)
+
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return self.wsgi_app(environ, start_response)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(self._path(environ, "prof"))
+                self._rotate()
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            sampler.stop()
+            with open(self._path(environ, "collapsed"), "w") as f:
+                f.writelines(
+                    f"{stack} {count}\n" for stack, count in sampler.stacks.items()
+                )
+            self._rotate()
+
+    def _path(self, environ, extension):
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # 404s, 405s and redirects all land here
+            endpoint = "unmatched"
+        name = f"{endpoint}.{time.time_ns()}.{os.getpid()}.{extension}"
+        return os.path.join(self.output_dir, name)
+
+    def _rotate(self):
+        paths = [
+            os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir)
+        ]
+        if len(paths) <= self.max_files:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: len(paths) - self.max_files]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another worker rotated it first
+                pass
+
+
+def init_app(app):
+    """Wrap a paste app in the profiler when profiling is configured.
+
+    Profiling is controlled by ``PASTE_PROFILE_RATE`` (fraction of requests,
+    default 0), ``PASTE_PROFILE_MODE`` (``cprofile`` or ``stack``),
+    ``PASTE_PROFILE_DIR`` and ``PASTE_PROFILE_MAX_FILES``. With no rate and no
+    admin token to flag requests with, the app is left unwrapped.
+    """
+    rate = float(os.environ.get("PASTE_PROFILE_RATE", "0"))
+    if not rate and not os.environ.get("PASTE_ADMIN_TOKEN"):
+        return
+    app.wsgi_app = SamplingProfiler(
+        app.wsgi_app,
+        app.url_map,
+        output_dir=os.environ.get("PASTE_PROFILE_DIR", "profiles"),
+        rate=rate,
+        mode=os.environ.get("PASTE_PROFILE_MODE", "cprofile"),
+        max_files=int(os.environ.get("PASTE_PROFILE_MAX_FILES", "200")),
+    )
@@ -0,0 +1,352 @@
+import hashlib
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, g, request
+
+from admin import is_admin
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Requests that are never limited: scraping must keep working under load
+EXEMPT_ENDPOINTS = {"metrics", "static"}
+
+# (rate per second, burst) for each scope and kind of request
+DEFAULT_LIMITS = {
+    ("client", "read"): (20.0, 100.0),
+    ("client", "write"): (1.0, 10.0),
+    ("global", "read"): (2000.0, 4000.0),
+    ("global", "write"): (100.0, 200.0),
+}
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def wait_time(levels, limits):
+    """Seconds until every bucket holds a token again; 0 if they all do now."""
+    return max(
+        (
+            (1 - tokens) / rate
+            for tokens, (_, rate, _) in zip(levels, limits)
+            if tokens < 1
+        ),
+        default=0.0,
+    )
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to someone else
+        pass
+    return True
+
+
+class LocalBuckets:
+    """Token buckets for this process only.
+
+    Client buckets are kept in an LRU of ``max_keys`` entries; a client that
+    falls out of it starts again with a full bucket.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, limits, now):
+        """Take one token from every ``(key, rate, burst)`` bucket, or none.
+
+        Returns 0 when the request may go ahead, otherwise the seconds until
+        every bucket has a token again.
+        """
+        with self._lock:
+            levels = []
+            for key, rate, burst in limits:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                levels.append(refill(tokens, updated, now, rate, burst))
+            wait = wait_time(levels, limits)
+            for tokens, (key, _, _) in zip(levels, limits):
+                self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedBuckets:
+    """Token buckets in memory shared by forked workers.
+
+    The mapping and its lock are created before gunicorn forks (serve.py
+    preloads the app), so every worker sees the same buckets. Buckets live
+    in a fixed table of ``slots``, indexed by a hash of their key; a client
+    whose slot is taken by another key starts again with a full bucket.
+    """
+
+    SLOT = struct.Struct("=Qdd")  # key hash, tokens, last refill
+    GLOBAL_SLOTS = 2  # Reserved so clients can never evict a global bucket
+
+    def __init__(self, slots=4096):
+        self.slots = slots
+        self._memory = mmap.mmap(-1, self.SLOT.size * slots)
+        self._lock = multiprocessing.Lock()
+
+    def _slot(self, key):
+        digest = int.from_bytes(
+            hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), "little"
+        )
+        if key[0] == "global":
+            index = 0 if key[1] == "read" else 1
+        else:
+            index = self.GLOBAL_SLOTS + digest % (self.slots - self.GLOBAL_SLOTS)
+        return digest, index * self.SLOT.size
+
+    def take(self, limits, now):
+        with self._lock:
+            slots, levels = [], []
+            for key, rate, burst in limits:
+                digest, offset = self._slot(key)
+                stored, tokens, updated = self.SLOT.unpack_from(self._memory, offset)
+                if stored != digest:
+                    tokens, updated = burst, now
+                slots.append((digest, offset))
+                levels.append(refill(tokens, updated, now, rate, burst))
+            wait = wait_time(levels, limits)
+            for tokens, (digest, offset) in zip(levels, slots):
+                self.SLOT.pack_into(
+                    self._memory,
+                    offset,
+                    digest,
+                    tokens - 1 if not wait else tokens,
+                    now,
+                )
+        return wait
+
+
+class SharedCounters:
+    """In-flight request and write counts, totalled over all worker processes.
+
+    Shedding needs the totals: a sync worker serves one request at a time,
+    so its own count never reaches a limit, and SQLite's writer is shared by
+    every process. Each process counts in its own slot, keyed by pid, of
+    memory shared by workers forked from a preloaded app, alongside running
+    totals. A worker killed mid-request never takes its counts back, so its
+    slot is subtracted from the totals and cleared by ``release`` when
+    gunicorn reaps it (serve.py's ``child_exit``); slots of processes that
+    no longer exist are also reclaimed whenever a new process takes one.
+    """
+
+    TOTALS = struct.Struct("=qq")  # in-flight requests, in-flight writes
+    SLOT = struct.Struct("=qqq")  # pid, in-flight requests, in-flight writes
+    FIELDS = ("in_flight", "writes")
+
+    def __init__(self, slots=1024):
+        self.slots = slots
+        self._memory = mmap.mmap(-1, self.TOTALS.size + self.SLOT.size * slots)
+        self._lock = multiprocessing.Lock()
+        self._pid = None
+        self._offset = None
+
+    def _offsets(self):
+        return range(self.TOTALS.size, len(self._memory), self.SLOT.size)
+
+    def _clear(self, offset):
+        _, *counts = self.SLOT.unpack_from(self._memory, offset)
+        totals = self.TOTALS.unpack_from(self._memory, 0)
+        self.TOTALS.pack_into(
+            self._memory, 0, *(total - count for total, count in zip(totals, counts))
+        )
+        self.SLOT.pack_into(self._memory, offset, 0, 0, 0)
+
+    def _claim(self):
+        """Return this process's slot, taking one on first use after a fork."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._offset
+        free = None
+        for offset in self._offsets():
+            owner = self.SLOT.unpack_from(self._memory, offset)[0]
+            # A slot already holding this pid was left by an earlier process
+            if owner and (owner == pid or not pid_alive(owner)):
+                self._clear(offset)
+                owner = 0
+            if not owner and free is None:
+                free = offset
+        if free is None:
+            raise RuntimeError("No free slot for this process's request counts")
+        self.SLOT.pack_into(self._memory, free, pid, 0, 0)
+        self._pid, self._offset = pid, free
+        return free
+
+    def adjust(self, counter, delta):
+        """Add ``delta`` to this process's count; return the total over all."""
+        field = self.FIELDS.index(counter)
+        with self._lock:
+            offset = self._claim()
+            slot = list(self.SLOT.unpack_from(self._memory, offset))
+            slot[field + 1] += delta
+            self.SLOT.pack_into(self._memory, offset, *slot)
+            totals = list(self.TOTALS.unpack_from(self._memory, 0))
+            totals[field] += delta
+            self.TOTALS.pack_into(self._memory, 0, *totals)
+            return totals[field]
+
+    def release(self, pid):
+        """Drop the counts of a process that has exited."""
+        with self._lock:
+            for offset in self._offsets():
+                if self.SLOT.unpack_from(self._memory, offset)[0] == pid:
+                    self._clear(offset)
+
+
+def parse_limit(value, default):
+    """Parse a ``rate,burst`` setting; a bare rate gets a burst of twice it."""
+    if not value:
+        return default
+    rate, _, burst = value.partition(",")
+    return float(rate), float(burst or float(rate) * 2)
+
+
+def reject(status, message, retry_after):
+    return Response(
+        message,
+        status,
+        {"Retry-After": str(max(1, math.ceil(retry_after)))},
+        mimetype="text/plain",
+    )
+
+
+def client_address(trusted_proxies):
+    """The client's address, seen through ``trusted_proxies`` reverse proxies.
+
+    Each trusted proxy appends the address it saw to X-Forwarded-For, so the
+    client is that many entries from the end; anything before that was sent
+    by the client and cannot be trusted.
+    """
+    if trusted_proxies:
+        forwarded = [
+            address.strip()
+            for address in request.headers.get("X-Forwarded-For", "").split(",")
+            if address.strip()
+        ]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.remote_addr
+
+
+def queued_ms():
+    """How long the request waited since the proxy stamped X-Request-Start."""
+    header = request.headers.get("X-Request-Start", "")
+    try:
+        # nginx sends "t=<seconds.millis>"
+        started = float(header.removeprefix("t="))
+    except ValueError:
+        return 0.0
+    return (time.time() - started) * 1000
+
+
+def shed_limits():
+    """Return ``(max_in_flight, max_writes, max_queue_ms)`` from the environment.
+
+    Without ``PASTE_SHED_MAX_WRITES``, writes are capped at half of
+    ``PASTE_WORKER_SLOTS`` (the requests the server runs at once, which
+    serve.py sets to workers × threads), so reads always keep the other
+    half of the slots.
+    """
+    slots = int(os.environ.get("PASTE_WORKER_SLOTS", "0"))
+    default_writes = max(slots // 2, 1) if slots else 16
+    return (
+        int(os.environ.get("PASTE_SHED_MAX_IN_FLIGHT", "64")),
+        int(os.environ.get("PASTE_SHED_MAX_WRITES", default_writes)),
+        float(os.environ.get("PASTE_SHED_MAX_QUEUE_MS", "500")),
+    )
+
+
+def init_app(app):
+    """Limit request rates and shed load before it reaches storage.
+
+    Off unless ``PASTE_RATE_LIMIT=1``. Each client and the app as a whole
+    get token buckets for reads and for writes; an empty bucket answers 429
+    with ``Retry-After``. Limits are ``rate,burst`` values in
+    ``PASTE_LIMIT_{CLIENT,GLOBAL}_{READ,WRITE}``. Clients are told apart by
+    remote address; behind reverse proxies, set ``PASTE_TRUSTED_PROXIES``
+    to how many there are so X-Forwarded-For is used instead. Before that,
+    requests are shed with a 503 when a proxy's ``X-Request-Start`` shows
+    the request waited over ``PASTE_SHED_MAX_QUEUE_MS`` (500 by default; 0
+    turns it off), when more than ``PASTE_SHED_MAX_WRITES`` writes are
+    queued on SQLite's single writer, or when more than
+    ``PASTE_SHED_MAX_IN_FLIGHT`` are already being served. Those counts are
+    always totalled over all workers forked from a preloaded app; buckets
+    are per process unless ``PASTE_RATE_LIMIT_SHARED=1``. Admin-token
+    holders are never limited.
+
+    Sync and gthread workers only see a request once a thread is free for
+    it, so in-flight never exceeds workers × threads and a backlog shows up
+    only as queue time: behind serve.py, shedding relies on the proxy
+    sending X-Request-Start, and on the write limit from ``shed_limits``.
+    The in-flight limit is for servers that admit more requests than they
+    have threads, such as async workers.
+    """
+    if os.environ.get("PASTE_RATE_LIMIT", "0") != "1":
+        return
+
+    if os.environ.get("PASTE_RATE_LIMIT_SHARED") == "1":
+        buckets = SharedBuckets()
+    else:
+        buckets = LocalBuckets()
+    counters = SharedCounters()
+    limits = {
+        (scope, kind): parse_limit(
+            os.environ.get(f"PASTE_LIMIT_{scope.upper()}_{kind.upper()}"), default
+        )
+        for (scope, kind), default in DEFAULT_LIMITS.items()
+    }
+    max_in_flight, max_writes, max_queue_ms = shed_limits()
+    trusted_proxies = int(os.environ.get("PASTE_TRUSTED_PROXIES", "0"))
+
+    @app.before_request
+    def limit_request():
+        if request.endpoint in EXEMPT_ENDPOINTS or is_admin():
+            return None
+        kind = "write" if request.method in WRITE_METHODS else "read"
+
+        if max_queue_ms and queued_ms() > max_queue_ms:
+            return reject(503, "Server busy, request waited too long\n", 1)
+
+        # Counted from here on, and released in teardown whatever happens
+        g.ratelimit_counters = ["in_flight"]
+        if counters.adjust("in_flight", 1) > max_in_flight:
+            return reject(503, "Server busy, try again shortly\n", 1)
+        if kind == "write":
+            g.ratelimit_counters.append("writes")
+            if counters.adjust("writes", 1) > max_writes:
+                return reject(503, "Too many writes queued, try again shortly\n", 1)
+
+        client = client_address(trusted_proxies)
+        wait = buckets.take(
+            [
+                (("client", kind, client), *limits["client", kind]),
+                (("global", kind), *limits["global", kind]),
+            ],
+            time.monotonic(),
+        )
+        if wait:
+            return reject(429, "Rate limit exceeded\n", wait)
+        return None
+
+    @app.teardown_request
+    def release_request(exc):
+        for counter in g.pop("ratelimit_counters", ()):
+            counters.adjust(counter, -1)
+
+    app.extensions["ratelimit"] = counters
@@ -0,0 +1,204 @@
+import argparse
+import math
+import random
+import sqlite3
+import sys
+import time
+
+from passwords import hash_password
+from storage import SQLiteStorage, build_line_index, utc_timestamp
+
+SEED_BATCH = 50_000
+CONTENT_POOL = 512
+MANIFEST_SIZE = 100_000
+
+# Rough shape of real paste traffic: mostly small snippets, a long tail of
+# logs and dumps. Sizes are log-normal around MEDIAN_SIZE characters.
+MEDIAN_SIZE = 400
+SIZE_SIGMA = 1.2
+MAX_SIZE = 512 * 1024
+LANGUAGES = {
+    "plaintext": 30,
+    "python": 18,
+    "javascript": 14,
+    "bash": 8,
+    "json": 8,
+    "sql": 6,
+    "yaml": 5,
+    "html": 4,
+    "css": 3,
+    "java": 2,
+    "c": 2,
+}
+PASSWORD_SHARE = 0.05
+EXPIRING_SHARE = 0.10
+SEED_PASSWORD = "seed-password"
+HISTORY_DAYS = 180
+
+WORDS = ("def", "class", "return", "import", "self", "value", "data", "error", "path")
+
+
+def paste_size(rng):
+    """Draw a paste length from the log-normal size distribution."""
+    size = int(rng.lognormvariate(math.log(MEDIAN_SIZE), SIZE_SIGMA))
+    return max(1, min(size, MAX_SIZE))
+
+
+def make_content(size, rng):
+    """Build paste text of exactly ``size`` characters in lines of varying width."""
+    lines, length = [], 0
+    while length < size:
+        indent = " " * (4 * rng.randrange(3))
+        line = indent + " ".join(rng.choices(WORDS, k=rng.randint(1, 12))) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:size]
+
+
+def content_pool(rng, count=CONTENT_POOL):
+    """Pre-build ``count`` bodies with their line indexes.
+
+    Generating text per row would dominate seeding time, so rows draw from
+    this pool instead; it is large enough that the size mix still holds.
+    """
+    pool = []
+    for _ in range(count):
+        content = make_content(paste_size(rng), rng)
+        offsets = build_line_index(content)
+        pool.append((content, len(offsets) - 1, offsets.tobytes()))
+    return pool
+
+
+def seed_id(number):
+    return f"seed{number:08d}"
+
+
+def seed(db_path, rows, rng, batch=SEED_BATCH):
+    """Make sure ``db_path`` holds at least ``rows`` seeded pastes.
+
+    Rows are inserted in batched transactions with ``synchronous=OFF``, and
+    seeding resumes from whatever the database already holds. Creation
+    times rise with the row number over the last HISTORY_DAYS, so the
+    created_at index is appended to rather than rebuilt at random.
+    """
+    storage = SQLiteStorage(db_path)
+    storage.init_db()
+    storage.close()
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF")
+    # Only seeded rows count; pastes created through the apps are not resumed
+    (existing,) = conn.execute(
+        f"SELECT COUNT(*) FROM pastes WHERE id GLOB 'seed{'[0-9]' * 8}'"
+    ).fetchone()
+    if existing >= rows:
+        conn.close()
+        return
+
+    pool = content_pool(rng)
+    # One hash shared by every protected row; hashing each would take hours
+    password_hash = hash_password(SEED_PASSWORD)
+    languages, weights = zip(*LANGUAGES.items())
+    now = time.time()
+    started = now - HISTORY_DAYS * 86400
+    step = (now - started) / rows
+    while existing < rows:
+        count = min(batch, rows - existing)
+        pastes, lines = [], []
+        for number in range(existing, existing + count):
+            paste_id = seed_id(number)
+            content, line_count, offsets = rng.choice(pool)
+            created = started + number * step
+            expires_at = None
+            if rng.random() < EXPIRING_SHARE:
+                expires_at = utc_timestamp(now + rng.uniform(3600, 30 * 86400))
+            password = password_hash if rng.random() < PASSWORD_SHARE else None
+            pastes.append(
+                (
+                    paste_id,
+                    content,
+                    f"Seeded {paste_id}",
+                    rng.choices(languages, weights)[0],
+                    utc_timestamp(created),
+                    expires_at,
+                    password,
+                )
+            )
+            lines.append((paste_id, line_count, offsets))
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO pastes (id, content, title, language, created_at, expires_at, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            pastes,
+        )
+        conn.executemany(
+            "INSERT INTO paste_lines (paste_id, line_count, offsets) VALUES (?, ?, ?)",
+            lines,
+        )
+        conn.execute("COMMIT")
+        existing += count
+        print(f"  seeded {existing}/{rows} rows", file=sys.stderr)
+
+    conn.close()
+
+
+def sample_ids(db_path, rows, rng, size=MANIFEST_SIZE):
+    """Pick up to ``size`` seeded ids that can be viewed without a password.
+
+    Ids are drawn at random from the first ``rows`` seeded pastes; protected
+    and expiring ones are dropped, since a load test reading them would
+    measure the password form or a redirect instead of a paste view.
+    """
+    candidates = sorted(rng.sample(range(rows), min(rows, size)))
+    conn = sqlite3.connect(db_path)
+    ids = []
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(candidates), 500):
+        chunk = [seed_id(n) for n in candidates[start : start + 500]]
+        placeholders = ",".join("?" * len(chunk))
+        ids.extend(
+            row[0]
+            for row in conn.execute(
+                f"SELECT id FROM pastes WHERE id IN ({placeholders}) AND password IS NULL AND expires_at IS NULL ORDER BY id",
+                chunk,
+            )
+        )
+    conn.close()
+    return ids
+
+
+def write_manifest(path, ids):
+    """Write one paste id per line, the format locustfile.py loads."""
+    with open(path, "w") as f:
+        f.writelines(f"{paste_id}\n" for paste_id in ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk-load realistic pastes into a paste database."
+    )
+    parser.add_argument("db_path", help="SQLite database to seed (created if missing)")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=SEED_BATCH)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument(
+        "--manifest",
+        default="seed_ids.txt",
+        help="Where to write the ids load tests read back",
+    )
+    parser.add_argument(
+        "--manifest-size",
+        type=int,
+        default=MANIFEST_SIZE,
+        help="How many ids to sample into the manifest",
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    seed(args.db_path, args.rows, rng, batch=args.batch)
+    ids = sample_ids(args.db_path, args.rows, rng, args.manifest_size)
+    write_manifest(args.manifest, ids)
+    print(f"Wrote {len(ids)} ids to {args.manifest}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
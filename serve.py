@@ -0,0 +1,146 @@
+import argparse
+import atexit
+import importlib
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+VARIANTS = ("simple", "intermediate", "advanced")
+# Names of the files prometheus_client writes in multiprocess mode
+METRIC_FILE = re.compile(r"(counter|gauge_\w+|histogram|summary)_\d+\.db")
+
+
+def prepare_metrics_dir(path):
+    """Make ``path`` ready for a fresh run's metric files.
+
+    Only metric files left by an earlier run are removed, so pointing this
+    at a directory holding anything else is harmless.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if METRIC_FILE.fullmatch(name):
+            os.remove(os.path.join(path, name))
+
+
+def remove_metrics_dir(path, owner_pid):
+    # Forked workers inherit atexit hooks; only the master that made it cleans up
+    if os.getpid() == owner_pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def compile_templates(app):
+    """Compile every template up front so no request pays for it."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def warm_up(module):
+    """Prime a worker: open DB connections, fill caches, render the home page."""
+    module.storage.warmup()
+    # Run the home page's view, leaving its queries, template and URL map hot
+    # for real traffic. Only the view is dispatched, not the request hooks,
+    # so warmup is not counted in metrics or the access log and spends no
+    # rate limit tokens.
+    with module.app.test_request_context("/"):
+        module.app.dispatch_request()
+
+
+class PasteServer(BaseApplication):
+    """Gunicorn application serving one paste app variant.
+
+    The app is imported and its templates compiled once in the master, so
+    workers share them (and the secret key signing flashes and unlock
+    cookies) after forking.
+    Each worker then opens its own DB connections and warms its caches in
+    ``post_worker_init``, which runs before the worker starts accepting.
+    Metrics of workers that exit are folded into the totals, and their
+    load-shedding counts dropped, in ``child_exit``.
+    """
+
+    def __init__(self, module, options):
+        self.module = module
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("preload_app", True)
+        self.cfg.set("post_worker_init", self.post_worker_init)
+        self.cfg.set("child_exit", self.child_exit)
+
+    def post_worker_init(self, worker):
+        warm_up(self.module)
+        worker.log.info("Worker %s warmed up", worker.pid)
+
+    def child_exit(self, server, worker):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+        counters = self.module.app.extensions.get("ratelimit")
+        if counters is not None:
+            # A worker killed mid-request never gave back its in-flight counts
+            counters.release(worker.pid)
+
+    def load(self):
+        return self.module.app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a paste app with gunicorn after warming it up."
+    )
+    parser.add_argument("variant", choices=VARIANTS, help="Which app to serve")
+    parser.add_argument("--bind", default="127.0.0.1:8000")
+    parser.add_argument(
+        "--workers", type=int, default=multiprocessing.cpu_count() * 2 + 1
+    )
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument(
+        "--metrics-dir",
+        help="Directory for per-worker metric files (default: a temp dir removed on exit)",
+    )
+    args = parser.parse_args()
+
+    # prometheus_client picks its multiprocess mode at import time, so this
+    # has to be in place before the app (and metrics.py) is imported
+    if args.metrics_dir:
+        metrics_dir = args.metrics_dir
+        prepare_metrics_dir(metrics_dir)
+    else:
+        metrics_dir = tempfile.mkdtemp(prefix="paste-metrics-")
+        atexit.register(remove_metrics_dir, metrics_dir, os.getpid())
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    if args.worker_class in ("sync", "gthread"):
+        # What ratelimit.shed_limits sizes the write limit from; read at import
+        os.environ.setdefault(
+            "PASTE_WORKER_SLOTS", str(args.workers * max(args.threads, 1))
+        )
+
+    module = importlib.import_module(args.variant)
+    module.init_db()
+    compile_templates(module.app)
+    # Connections must not cross fork(); each worker opens its own
+    module.storage.close()
+
+    PasteServer(
+        module,
+        {
+            "bind": args.bind,
+            "workers": args.workers,
+            "threads": args.threads,
+            "worker_class": args.worker_class,
+            "timeout": args.timeout,
+            "accesslog": "-",
+        },
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
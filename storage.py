@@ -0,0 +1,902 @@
+import heapq
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+from delta import apply_delta, make_delta
+from passwords import hash_password, is_hashed
+
+Paste = namedtuple(
+    "Paste",
+    "id content title language created_at expires_at password parent_id",
+    defaults=(None,),
+)
+
+# A revision is stored as a delta against its parent unless that would make
+# the chain of deltas to rebuild it longer than this, in which case it is
+# stored in full and starts a new chain
+SNAPSHOT_INTERVAL = 16
+# Revisions where either side is longer than this (in characters) are stored
+# in full: diffing them is too slow, and their line windows should stay
+# plain substring reads rather than delta replays
+DELTA_MAX_SIZE = 256 * 1024
+
+# Views count for half as much in the popularity ranking after this long
+POPULARITY_HALF_LIFE = 24 * 3600
+# Popularity scores are log2 of the views weighted by 2 ** (age since this
+# epoch / half-life), so scores written at different times compare directly
+# and nothing has to be rewritten as they decay
+POPULARITY_EPOCH = 1_700_000_000
+
+
+def utc_timestamp(seconds=None):
+    """Format a time the way SQLite's CURRENT_TIMESTAMP does."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+
+def timed(method):
+    """Report a storage call's duration, and whether SQLite was busy, to listeners."""
+    operation = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        except sqlite3.OperationalError as exc:
+            if "locked" in str(exc) or "busy" in str(exc):
+                self._notify("busy", operation=operation)
+            raise
+        finally:
+            self._notify(
+                "query", operation=operation, seconds=time.perf_counter() - started
+            )
+
+    return wrapper
+
+
+def popularity_score(score, views, now):
+    """Add ``views`` seen at ``now`` to a popularity score (None if there is none)."""
+    added = math.log2(views) + (now - POPULARITY_EPOCH) / POPULARITY_HALF_LIFE
+    if score is None:
+        return added
+    high, low = max(score, added), min(score, added)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def build_line_index(content):
+    """Return the character offset of each line start, plus len(content)."""
+    offsets = array("I", [0])
+    pos = content.find("\n")
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = content.find("\n", pos + 1)
+    if offsets[-1] != len(content):
+        offsets.append(len(content))
+    return offsets
+
+
+class Storage:
+    """Interface shared by the paste storage backends.
+
+    Rows returned by ``recent`` are ``(id, title, created_at)`` tuples, which
+    is what the index templates unpack; ``popular`` adds the view count.
+    Line windows are 1-based and inclusive, and ``get_lines`` returns
+    ``(text, start, end, line_count)`` with the range clamped to the paste.
+    A paste created with ``parent_id`` is a revision of that paste.
+    """
+
+    db_path = None
+    listeners = ()
+
+    def add_listener(self, listener):
+        """Subscribe ``listener(event, **fields)`` to this backend's events.
+
+        Events are ``query`` (operation, seconds), ``lock_wait`` (seconds),
+        ``busy`` (operation) and ``cache`` (result: "hit" or "miss").
+        """
+        # Replaced rather than appended to, so _notify never sees it change
+        self.listeners = (*self.listeners, listener)
+
+    def _notify(self, event, **fields):
+        for listener in self.listeners:
+            listener(event, **fields)
+
+    def init_db(self):
+        """Prepare the backend for use."""
+
+    def warmup(self):
+        """Open connections and pull hot data in before serving traffic."""
+
+    def close(self):
+        """Release resources held by the calling thread."""
+
+    def create(
+        self,
+        paste_id,
+        content,
+        title=None,
+        password=None,
+        language="plaintext",
+        expires_at=None,
+        parent_id=None,
+    ):
+        """Store a new paste."""
+        raise NotImplementedError
+
+    def get(self, paste_id, content=True):
+        """Return a Paste, or None. With content=False the body is skipped."""
+        raise NotImplementedError
+
+    def get_lines(self, paste_id, start, end):
+        """Return a window of lines from a paste, or None if it is missing."""
+        raise NotImplementedError
+
+    def recent(self, limit=10):
+        """Return the newest unexpired pastes."""
+        raise NotImplementedError
+
+    def add_views(self, counts, now=None):
+        """Add a batch of ``{paste_id: views}`` to the counts and popularity."""
+        raise NotImplementedError
+
+    def popular(self, limit=10):
+        """Return the unexpired pastes with the highest decayed view counts."""
+        raise NotImplementedError
+
+    def set_password(self, paste_id, old, new):
+        """Replace a paste's password if it is still ``old``.
+
+        Returns whether it was replaced.
+        """
+        raise NotImplementedError
+
+    def delete(self, paste_id):
+        """Remove a paste. Returns whether it existed."""
+        raise NotImplementedError
+
+    def expire(self):
+        """Remove every expired paste. Returns how many were removed."""
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    """Pastes stored in SQLite, one connection per thread.
+
+    Revisions are stored as a compressed delta against their parent, with
+    an empty ``content``, until the chain reaches SNAPSHOT_INTERVAL. The
+    last ``body_cache_size`` bodies rebuilt from deltas are kept, so paging
+    through a revision does not replay its chain for every window.
+    """
+
+    def __init__(self, db_path, timeout=5.0, body_cache_size=32):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.body_cache_size = body_cache_size
+        self._local = threading.local()
+        self._bodies = OrderedDict()
+        self._bodies_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly below
+            conn = sqlite3.connect(
+                self.db_path, timeout=self.timeout, isolation_level=None
+            )
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, mode=""):
+        conn = self._connect()
+        started = time.perf_counter()
+        conn.execute(f"BEGIN {mode}")
+        if mode == "IMMEDIATE":
+            # Time spent queued behind other writers for SQLite's write lock
+            self._notify("lock_wait", seconds=time.perf_counter() - started)
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _write(self):
+        # Take the write lock up front so a read never has to be upgraded
+        return self._transaction("IMMEDIATE")
+
+    def warmup(self):
+        """Open this thread's connection and read the pages behind the home page."""
+        for paste_id, _, _ in self.recent():
+            self.get(paste_id, content=False)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def init_db(self):
+        """Initialize the SQLite database with the pastes table."""
+        conn = self._connect()
+        # WAL lets readers and online backups run alongside the writer
+        conn.execute("PRAGMA journal_mode=WAL")
+        with self._write():
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS pastes (
+                id TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                title TEXT,
+                language TEXT DEFAULT 'plaintext',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                password TEXT
+            )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pastes)")}
+            if "language" not in columns:
+                # Databases created by simple.py predate the language column
+                conn.execute(
+                    "ALTER TABLE pastes ADD COLUMN language TEXT DEFAULT 'plaintext'"
+                )
+            if "parent_id" not in columns:
+                conn.execute("ALTER TABLE pastes ADD COLUMN parent_id TEXT")
+                conn.execute("ALTER TABLE pastes ADD COLUMN delta BLOB")
+                conn.execute(
+                    "ALTER TABLE pastes ADD COLUMN chain_depth INTEGER NOT NULL DEFAULT 0"
+                )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_pastes_parent_id ON pastes(parent_id)"
+            )
+            # recent() reads the newest rows; without this it sorts the whole table
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_pastes_created_at ON pastes(created_at)"
+            )
+            # offsets holds the start offset of every line plus an end sentinel,
+            # packed as unsigned 32-bit ints, so line N starts at byte 4 * N
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS paste_lines (
+                paste_id TEXT PRIMARY KEY REFERENCES pastes(id),
+                line_count INTEGER NOT NULL,
+                offsets BLOB NOT NULL
+            )
+            """)
+            # View counts, flushed in batches; score orders the popular list
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS paste_views (
+                paste_id TEXT PRIMARY KEY REFERENCES pastes(id),
+                views INTEGER NOT NULL,
+                score REAL NOT NULL
+            )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_paste_views_score ON paste_views(score)"
+            )
+            (version,) = conn.execute("PRAGMA user_version").fetchone()
+            if version < 1:
+                # Older apps stored an empty form field for "no password".
+                # Plaintext passwords are left for hash_passwords and for
+                # the first unlock, since scrypt would hold up startup.
+                conn.execute("UPDATE pastes SET password = NULL WHERE password = ''")
+                conn.execute("PRAGMA user_version = 1")
+
+    def hash_passwords(self, batch_size=100, progress=None):
+        """Replace any plaintext passwords left in the table with hashes.
+
+        scrypt is deliberately slow, so each batch is hashed before taking
+        the write lock, and rows changed meanwhile are left alone. Calls
+        ``progress(hashed)`` after every batch; returns the number hashed.
+        """
+        conn = self._connect()
+        hashed = 0
+        last_id = ""
+        while True:
+            rows = conn.execute(
+                "SELECT id, password FROM pastes WHERE id > ? AND password IS NOT NULL"
+                " AND password != '' ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return hashed
+            last_id = rows[-1][0]
+            updates = [
+                (hash_password(password), paste_id, password)
+                for paste_id, password in rows
+                if not is_hashed(password)
+            ]
+            if updates:
+                with self._write():
+                    before = conn.total_changes
+                    conn.executemany(
+                        "UPDATE pastes SET password = ? WHERE id = ? AND password = ?",
+                        updates,
+                    )
+                    hashed += conn.total_changes - before
+            if progress:
+                progress(hashed)
+
+    def _store_line_index(self, conn, paste_id, offsets):
+        conn.execute(
+            "INSERT OR REPLACE INTO paste_lines (paste_id, line_count, offsets) VALUES (?, ?, ?)",
+            (paste_id, len(offsets) - 1, offsets.tobytes()),
+        )
+        return len(offsets) - 1
+
+    def _content(self, conn, paste_id):
+        """Return the full body of a paste, replaying deltas if needed.
+
+        Returns ``(content, chain_depth)``, or None if the paste is missing.
+        """
+        with self._bodies_lock:
+            cached = self._bodies.get(paste_id)
+            if cached is not None:
+                self._bodies.move_to_end(paste_id)
+                return cached
+        rows = conn.execute(
+            """
+            WITH RECURSIVE chain(id, parent_id, content, delta, depth, step) AS (
+                SELECT id, parent_id, content, delta, chain_depth, 0
+                FROM pastes WHERE id = ?
+                UNION ALL
+                SELECT p.id, p.parent_id, p.content, p.delta, p.chain_depth, chain.step + 1
+                FROM pastes p JOIN chain ON p.id = chain.parent_id
+                WHERE chain.delta IS NOT NULL
+            )
+            SELECT content, delta, depth FROM chain ORDER BY step DESC
+            """,
+            (paste_id,),
+        ).fetchall()
+        if not rows:
+            return None
+        content = rows[0][0]
+        for _, delta, _ in rows[1:]:
+            content = apply_delta(content, delta)
+        if len(rows) > 1:
+            # A revision's text never changes, only how it is stored
+            with self._bodies_lock:
+                self._bodies[paste_id] = (content, rows[-1][2])
+                if len(self._bodies) > self.body_cache_size:
+                    self._bodies.popitem(last=False)
+        return content, rows[-1][2]
+
+    def _forget(self, paste_ids):
+        with self._bodies_lock:
+            for paste_id in paste_ids:
+                self._bodies.pop(paste_id, None)
+
+    def _detach_children(self, conn, where, params=()):
+        """Store delta revisions of the pastes matching ``where`` in full.
+
+        Called before those pastes are removed, so no revision is left
+        pointing at a parent that no longer exists.
+        """
+        children = conn.execute(
+            f"SELECT id, delta IS NOT NULL, chain_depth FROM pastes WHERE parent_id IN (SELECT id FROM pastes WHERE {where})",
+            params,
+        ).fetchall()
+        for child_id, is_delta, depth in children:
+            if is_delta:
+                content, _ = self._content(conn, child_id)
+                conn.execute(
+                    "UPDATE pastes SET content = ?, delta = NULL, chain_depth = 0 WHERE id = ?",
+                    (content, child_id),
+                )
+                # Its delta descendants now chain back to it instead
+                conn.execute(
+                    """
+                    WITH RECURSIVE descendants(id) AS (
+                        SELECT id FROM pastes WHERE parent_id = ? AND delta IS NOT NULL
+                        UNION ALL
+                        SELECT p.id FROM pastes p JOIN descendants d ON p.parent_id = d.id
+                        WHERE p.delta IS NOT NULL
+                    )
+                    UPDATE pastes SET chain_depth = chain_depth - ?
+                    WHERE id IN (SELECT id FROM descendants)
+                    """,
+                    (child_id, depth),
+                )
+            conn.execute("UPDATE pastes SET parent_id = NULL WHERE id = ?", (child_id,))
+
+    @timed
+    def create(
+        self,
+        paste_id,
+        content,
+        title=None,
+        password=None,
+        language="plaintext",
+        expires_at=None,
+        parent_id=None,
+    ):
+        # Diff against the parent in a read transaction: the delta can take
+        # a while, and holding the write lock meanwhile would stall every
+        # other writer
+        body, delta, depth = content, None, 0
+        parent = None
+        if parent_id:
+            with self._transaction() as conn:
+                parent = self._content(conn, parent_id)
+                # Read afresh: a cached body can outlive its row or chain
+                row = conn.execute(
+                    "SELECT chain_depth FROM pastes WHERE id = ?", (parent_id,)
+                ).fetchone()
+                parent = None if parent is None or row is None else (parent[0], row[0])
+        if (
+            parent is not None
+            and parent[1] + 1 < SNAPSHOT_INTERVAL
+            and max(len(parent[0]), len(content)) <= DELTA_MAX_SIZE
+        ):
+            candidate = make_delta(parent[0], content)
+            # Tiny pastes can compress worse than they diff
+            if len(candidate) < len(content.encode()):
+                body, delta, depth = "", candidate, parent[1] + 1
+        offsets = build_line_index(content)
+
+        with self._write() as conn:
+            if parent is None:
+                parent_id = None
+            else:
+                row = conn.execute(
+                    "SELECT chain_depth FROM pastes WHERE id = ?", (parent_id,)
+                ).fetchone()
+                if row is None or row[0] != parent[1]:
+                    # The parent was deleted or re-stored in full while the
+                    # delta was made, so the chain it assumed may be gone
+                    body, delta, depth = content, None, 0
+                if row is None:
+                    parent_id = None
+            conn.execute(
+                "INSERT INTO pastes (id, content, title, password, language, expires_at, parent_id, delta, chain_depth) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    paste_id,
+                    body,
+                    title,
+                    password,
+                    language,
+                    expires_at,
+                    parent_id,
+                    delta,
+                    depth,
+                ),
+            )
+            self._store_line_index(conn, paste_id, offsets)
+
+    @timed
+    def get(self, paste_id, content=True):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT id, NULL, title, language, created_at, expires_at, password, parent_id FROM pastes WHERE id = ?",
+            (paste_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        paste = Paste(*row)
+        if content:
+            with self._transaction() as conn:
+                body = self._content(conn, paste_id)
+            if body is None:
+                return None
+            paste = paste._replace(content=body[0])
+        return paste
+
+    @timed
+    def get_lines(self, paste_id, start, end):
+        """Read a window of lines without loading the whole paste.
+
+        Only the two offsets bounding the window are pulled from the index,
+        and SQLite slices the content, so the cost does not depend on
+        splitting the whole paste.
+        """
+        row = (
+            self._connect()
+            .execute(
+                "SELECT line_count FROM paste_lines WHERE paste_id = ?", (paste_id,)
+            )
+            .fetchone()
+        )
+        if row is None:
+            # Pastes created before the index existed get one on first view
+            with self._transaction() as conn:
+                paste = self._content(conn, paste_id)
+            if paste is None:
+                return None
+            offsets = build_line_index(paste[0])
+            with self._write() as conn:
+                # Unless it was deleted meanwhile
+                if not conn.execute(
+                    "SELECT 1 FROM pastes WHERE id = ?", (paste_id,)
+                ).fetchone():
+                    return None
+                line_count = self._store_line_index(conn, paste_id, offsets)
+        else:
+            (line_count,) = row
+
+        end = min(end, line_count)
+        start = min(start, end)
+        with self._transaction() as conn:
+            bounds = conn.execute(
+                """
+                SELECT substr(l.offsets, ?, 4), substr(l.offsets, ?, 4), p.delta IS NOT NULL
+                FROM paste_lines l JOIN pastes p ON p.id = l.paste_id
+                WHERE l.paste_id = ?
+                """,
+                ((start - 1) * 4 + 1, end * 4 + 1, paste_id),
+            ).fetchone()
+            if bounds is None:
+                # Deleted since the line count was read
+                return None
+            first, last = array("I", bounds[0] + bounds[1])
+            if bounds[2]:
+                # Delta revisions have no stored body to slice
+                text = self._content(conn, paste_id)[0][first:last]
+            else:
+                (text,) = conn.execute(
+                    "SELECT substr(content, ?, ?) FROM pastes WHERE id = ?",
+                    (first + 1, last - first, paste_id),
+                ).fetchone()
+        return text, start, end, line_count
+
+    @timed
+    def recent(self, limit=10):
+        cursor = self._connect().execute(
+            """
+            SELECT id, title, created_at
+            FROM pastes
+            WHERE expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP
+            ORDER BY created_at DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        return cursor.fetchall()
+
+    @timed
+    def add_views(self, counts, now=None):
+        now = time.time() if now is None else now
+        ids = list(counts)
+        with self._write() as conn:
+            scores = {}
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                scores.update(
+                    conn.execute(
+                        f"SELECT paste_id, score FROM paste_views WHERE paste_id IN ({placeholders})",
+                        chunk,
+                    )
+                )
+            conn.executemany(
+                """
+                INSERT INTO paste_views (paste_id, views, score) VALUES (?, ?, ?)
+                ON CONFLICT(paste_id) DO UPDATE
+                SET views = views + excluded.views, score = excluded.score
+                """,
+                (
+                    (
+                        paste_id,
+                        views,
+                        popularity_score(scores.get(paste_id), views, now),
+                    )
+                    for paste_id, views in counts.items()
+                ),
+            )
+
+    @timed
+    def popular(self, limit=10):
+        cursor = self._connect().execute(
+            """
+            SELECT p.id, p.title, p.created_at, v.views
+            FROM paste_views v JOIN pastes p ON p.id = v.paste_id
+            WHERE p.expires_at IS NULL OR p.expires_at > CURRENT_TIMESTAMP
+            ORDER BY v.score DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        return cursor.fetchall()
+
+    @timed
+    def set_password(self, paste_id, old, new):
+        with self._write() as conn:
+            cursor = conn.execute(
+                "UPDATE pastes SET password = ? WHERE id = ? AND password = ?",
+                (new, paste_id, old),
+            )
+        return cursor.rowcount > 0
+
+    @timed
+    def delete(self, paste_id):
+        with self._write() as conn:
+            self._detach_children(conn, "id = ?", (paste_id,))
+            conn.execute("DELETE FROM paste_views WHERE paste_id = ?", (paste_id,))
+            conn.execute("DELETE FROM paste_lines WHERE paste_id = ?", (paste_id,))
+            cursor = conn.execute("DELETE FROM pastes WHERE id = ?", (paste_id,))
+        self._forget([paste_id])
+        return cursor.rowcount > 0
+
+    @timed
+    def expire(self):
+        with self._write() as conn:
+            self._detach_children(conn, "expires_at <= CURRENT_TIMESTAMP")
+            expired = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM pastes WHERE expires_at <= CURRENT_TIMESTAMP"
+                )
+            ]
+            for table in ("paste_views", "paste_lines"):
+                conn.execute(f"""
+                DELETE FROM {table} WHERE paste_id IN (
+                    SELECT id FROM pastes WHERE expires_at <= CURRENT_TIMESTAMP
+                )
+                """)
+            cursor = conn.execute(
+                "DELETE FROM pastes WHERE expires_at <= CURRENT_TIMESTAMP"
+            )
+        self._forget(expired)
+        return cursor.rowcount
+
+
+class MemoryStorage(Storage):
+    """Pastes kept in process memory, for load tests that should not touch disk.
+
+    Nothing here takes a lock: every mutation is a single dict or list
+    operation, which is atomic under the GIL, and readers tolerate ids in
+    ``_order`` whose paste has since been removed. Each process has its own
+    copy, so run it with a single worker. Revisions keep their full text;
+    only the link to the parent is recorded.
+    """
+
+    def __init__(self):
+        self._pastes = {}
+        self._offsets = {}
+        self._order = []
+        self._views = {}  # paste_id -> (views, score)
+
+    def create(
+        self,
+        paste_id,
+        content,
+        title=None,
+        password=None,
+        language="plaintext",
+        expires_at=None,
+        parent_id=None,
+    ):
+        if parent_id not in self._pastes:
+            parent_id = None
+        self._offsets[paste_id] = build_line_index(content)
+        self._pastes[paste_id] = Paste(
+            paste_id,
+            content,
+            title,
+            language,
+            utc_timestamp(),
+            expires_at,
+            password,
+            parent_id,
+        )
+        self._order.append(paste_id)
+
+    def get(self, paste_id, content=True):
+        paste = self._pastes.get(paste_id)
+        if paste is None or content:
+            return paste
+        return paste._replace(content=None)
+
+    def get_lines(self, paste_id, start, end):
+        paste = self._pastes.get(paste_id)
+        offsets = self._offsets.get(paste_id)
+        if paste is None or offsets is None:
+            return None
+        line_count = len(offsets) - 1
+        end = min(end, line_count)
+        start = min(start, end)
+        text = paste.content[offsets[start - 1] : offsets[end]]
+        return text, start, end, line_count
+
+    def recent(self, limit=10):
+        now = utc_timestamp()
+        rows = []
+        for paste_id in reversed(self._order):
+            paste = self._pastes.get(paste_id)
+            if paste is None or (paste.expires_at and paste.expires_at <= now):
+                continue
+            rows.append((paste.id, paste.title, paste.created_at))
+            if len(rows) == limit:
+                break
+        return rows
+
+    def add_views(self, counts, now=None):
+        now = time.time() if now is None else now
+        for paste_id, views in counts.items():
+            total, score = self._views.get(paste_id, (0, None))
+            self._views[paste_id] = (
+                total + views,
+                popularity_score(score, views, now),
+            )
+
+    def popular(self, limit=10):
+        now = utc_timestamp()
+        ranked = []
+        for paste_id, (views, score) in list(self._views.items()):
+            paste = self._pastes.get(paste_id)
+            if paste is None or (paste.expires_at and paste.expires_at <= now):
+                continue
+            ranked.append((score, (paste.id, paste.title, paste.created_at, views)))
+        return [row for _, row in heapq.nlargest(limit, ranked, key=lambda r: r[0])]
+
+    def set_password(self, paste_id, old, new):
+        paste = self._pastes.get(paste_id)
+        if paste is None or paste.password != old:
+            return False
+        self._pastes[paste_id] = paste._replace(password=new)
+        return True
+
+    def delete(self, paste_id):
+        self._offsets.pop(paste_id, None)
+        self._views.pop(paste_id, None)
+        return self._pastes.pop(paste_id, None) is not None
+
+    def expire(self):
+        now = utc_timestamp()
+        expired = [
+            paste.id
+            for paste in list(self._pastes.values())
+            if paste.expires_at and paste.expires_at <= now
+        ]
+        for paste_id in expired:
+            self.delete(paste_id)
+        # Drop ids of removed pastes so recent() does not keep skipping them.
+        # Only the prefix seen so far is rewritten, in one slice assignment,
+        # so ids appended concurrently are kept.
+        seen = len(self._order)
+        self._order[:seen] = [
+            paste_id for paste_id in self._order[:seen] if paste_id in self._pastes
+        ]
+        return len(expired)
+
+
+class CachedStorage(Storage):
+    """Per-process read-through cache in front of another backend.
+
+    Paste lookups are kept in an LRU of ``maxsize`` entries; pastes larger
+    than ``max_content`` characters are not cached. The recent list is
+    cached for ``recent_ttl`` seconds, since pastes created by other worker
+    processes cannot invalidate it, and the popular list, which moves
+    slowly, for ``popular_ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        backend,
+        maxsize=1024,
+        recent_ttl=1.0,
+        popular_ttl=10.0,
+        max_content=64 * 1024,
+    ):
+        self.backend = backend
+        self.db_path = backend.db_path
+        self.maxsize = maxsize
+        self.recent_ttl = recent_ttl
+        self.popular_ttl = popular_ttl
+        self.max_content = max_content
+        self._pastes = OrderedDict()
+        self._recent = {}
+        self._popular = {}
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        super().add_listener(listener)
+        self.backend.add_listener(listener)
+
+    def init_db(self):
+        self.backend.init_db()
+
+    def warmup(self):
+        """Warm the backend, then fill the cache with the home page's pastes."""
+        self.backend.warmup()
+        for paste_id, _, _ in self.recent():
+            self.get(paste_id, content=False)
+            self.get(paste_id)
+
+    def close(self):
+        self.backend.close()
+
+    def create(self, paste_id, content, **kwargs):
+        self.backend.create(paste_id, content, **kwargs)
+        self._recent.clear()
+
+    def get(self, paste_id, content=True):
+        key = (paste_id, content)
+        with self._lock:
+            paste = self._pastes.get(key)
+            if paste is not None:
+                self._pastes.move_to_end(key)
+        if paste is not None:
+            self._notify("cache", result="hit")
+            return paste
+        self._notify("cache", result="miss")
+
+        paste = self.backend.get(paste_id, content=content)
+        if paste is not None and len(paste.content or "") <= self.max_content:
+            with self._lock:
+                self._pastes[key] = paste
+                if len(self._pastes) > self.maxsize:
+                    self._pastes.popitem(last=False)
+        return paste
+
+    def get_lines(self, paste_id, start, end):
+        return self.backend.get_lines(paste_id, start, end)
+
+    def recent(self, limit=10):
+        cached = self._recent.get(limit)
+        if cached is not None and time.monotonic() - cached[0] < self.recent_ttl:
+            self._notify("cache", result="hit")
+            return cached[1]
+        self._notify("cache", result="miss")
+        rows = self.backend.recent(limit)
+        self._recent[limit] = (time.monotonic(), rows)
+        return rows
+
+    def add_views(self, counts, now=None):
+        self.backend.add_views(counts, now=now)
+
+    def popular(self, limit=10):
+        cached = self._popular.get(limit)
+        if cached is not None and time.monotonic() - cached[0] < self.popular_ttl:
+            self._notify("cache", result="hit")
+            return cached[1]
+        self._notify("cache", result="miss")
+        rows = self.backend.popular(limit)
+        self._popular[limit] = (time.monotonic(), rows)
+        return rows
+
+    def set_password(self, paste_id, old, new):
+        with self._lock:
+            self._pastes.pop((paste_id, True), None)
+            self._pastes.pop((paste_id, False), None)
+        return self.backend.set_password(paste_id, old, new)
+
+    def delete(self, paste_id):
+        with self._lock:
+            self._pastes.pop((paste_id, True), None)
+            self._pastes.pop((paste_id, False), None)
+        self._recent.clear()
+        self._popular.clear()
+        return self.backend.delete(paste_id)
+
+    def expire(self):
+        removed = self.backend.expire()
+        if removed:
+            with self._lock:
+                self._pastes.clear()
+            self._recent.clear()
+            self._popular.clear()
+        return removed
+
+
+def create_storage(backend, db_path, cache_size=0):
+    """Build the storage backend named by the PASTE_STORAGE setting.
+
+    A non-zero ``cache_size`` puts a CachedStorage of that many entries in
+    front of it.
+    """
+    if backend == "sqlite":
+        storage = SQLiteStorage(db_path)
+    elif backend == "memory":
+        storage = MemoryStorage()
+    else:
+        raise ValueError(
+            f"Unknown storage backend {backend!r}; use 'sqlite' or 'memory'"
+        )
+    if cache_size:
+        storage = CachedStorage(storage, maxsize=cache_size)
+    return storage
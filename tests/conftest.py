@@ -0,0 +1,56 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The app modules live at the top level of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import CachedStorage, MemoryStorage, SQLiteStorage
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "pastes.db"))
+    storage.init_db()
+    yield storage
+    storage.close()
+
+
+@pytest.fixture(params=["sqlite", "memory", "cached"])
+def storage(request, tmp_path):
+    """Each backend in turn, for behaviour they must all share."""
+    if request.param == "memory":
+        yield MemoryStorage()
+        return
+    backend = SQLiteStorage(str(tmp_path / "pastes.db"))
+    if request.param == "cached":
+        backend = CachedStorage(backend)
+    backend.init_db()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Import a fresh copy of an app variant, backed by a temporary database."""
+    monkeypatch.setenv("PASTE_DB_PATH", str(tmp_path / "pastes.db"))
+    monkeypatch.setenv("PASTE_SECRET_KEY", "test")
+    loaded = []
+
+    def load(name):
+        if name in sys.modules:
+            module = importlib.reload(sys.modules[name])
+        else:
+            module = importlib.import_module(name)
+        module.init_db()
+        loaded.append(module)
+        return module
+
+    yield load
+    for module in loaded:
+        if hasattr(module, "view_counter"):
+            # Before the database goes away with tmp_path
+            module.view_counter.flush()
+        module.storage.close()
@@ -0,0 +1,93 @@
+import pytest
+
+LINES = "".join(f"line {i}\n" for i in range(1, 1201))
+
+
+@pytest.fixture
+def advanced(load_app):
+    return load_app("advanced")
+
+
+@pytest.fixture
+def client(advanced):
+    return advanced.app.test_client()
+
+
+def create(client, content=LINES, **form):
+    response = client.post("/paste", data={"content": content, **form})
+    return response.location.rsplit("/", 1)[1]
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (None, (1, 500)),
+        ("", (1, 500)),
+        ("junk", (1, 500)),
+        ("10", (10, 509)),
+        ("10-20", (10, 20)),
+        ("20-10", (20, 20)),
+        ("0-5", (1, 5)),
+        # Never more than one window, however wide the request
+        ("1-100000", (1, 500)),
+        ("700-100000", (700, 1199)),
+    ],
+)
+def test_parse_line_range(advanced, value, expected):
+    assert advanced.parse_line_range(value) == expected
+
+
+def test_view_renders_one_window(client):
+    paste_id = create(client)
+
+    page = client.get(f"/paste/{paste_id}?lines=1-100000").get_data(as_text=True)
+    assert "line 500\n" in page
+    assert "line 501\n" not in page
+
+
+def test_lines_endpoint_is_capped(client):
+    paste_id = create(client)
+
+    window = client.get(f"/paste/{paste_id}/lines?lines=601-100000").get_json()
+    assert (window["start"], window["end"], window["line_count"]) == (601, 1100, 1200)
+    assert window["content"].startswith("line 601\n")
+
+
+def test_raw(client):
+    paste_id = create(client)
+
+    response = client.get(f"/paste/{paste_id}/raw")
+    assert response.get_data(as_text=True) == LINES
+    assert response.mimetype == "text/plain"
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+    assert client.get("/paste/missing/raw").status_code == 404
+
+
+def test_raw_needs_unlock(client):
+    paste_id = create(client, "secret", password="pw")
+
+    assert client.get(f"/paste/{paste_id}/raw").status_code == 403
+    client.post(f"/paste/{paste_id}/unlock", data={"password": "pw"})
+    assert client.get(f"/paste/{paste_id}/raw").get_data(as_text=True) == "secret"
+
+
+@pytest.mark.parametrize(
+    ("target", "expected"),
+    [
+        ("/paste/p1", "/paste/p1"),
+        ("/paste/p1/raw", "/paste/p1/raw"),
+        ("/paste/p1/fork", "/paste/p1/fork"),
+        ("/paste/p1/lines?lines=5-9", "/paste/p1/lines?lines=5-9"),
+        ("", None),
+        ("/", None),
+        ("/paste/p2", None),
+        ("/paste/p1x/../..", None),
+        ("/paste/p1/../../admin", None),
+        ("//evil.example/paste/p1", None),
+        ("https://evil.example/paste/p1", None),
+        ("javascript:alert(1)", None),
+    ],
+)
+def test_paste_page(advanced, target, expected):
+    with advanced.app.test_request_context():
+        assert advanced.paste_page(target, "p1") == expected
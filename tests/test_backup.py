@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import time
+
+import pytest
+from flask import Flask
+
+import backup
+
+HEADERS = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture
+def full_disk(monkeypatch):
+    """Make renaming a finished backup into place fail."""
+    replace = os.replace
+
+    def fail_on_backup(src, dst):
+        if src.endswith(".part"):
+            raise OSError(28, "No space left on device")
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", fail_on_backup)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "pastes.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE pastes (id TEXT PRIMARY KEY, content TEXT)")
+    conn.executemany(
+        "INSERT INTO pastes VALUES (?, ?)", ((str(i), "x" * 500) for i in range(500))
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_backup_database(db_path, tmp_path):
+    dest = str(tmp_path / "copy.db")
+    steps = []
+
+    stats = backup.backup_database(
+        db_path, dest, pages=8, sleep=0, progress=steps.append
+    )
+
+    assert stats["pages_done"] == stats["pages_total"] > 8
+    assert len(steps) == stats["steps"] > 1
+    assert not os.path.exists(f"{dest}.part")
+    count = sqlite3.connect(dest).execute("SELECT COUNT(*) FROM pastes").fetchone()
+    assert count == (500,)
+
+
+def test_failed_backup_removes_partial_file(db_path, tmp_path, full_disk):
+    with pytest.raises(OSError):
+        backup.backup_database(db_path, str(tmp_path / "copy.db"), sleep=0)
+
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("copy")]
+
+
+def run_backup(client, headers):
+    assert client.post("/admin/backup", headers=headers).status_code == 202
+    for _ in range(200):
+        status = client.get("/admin/backup", headers=headers).get_json()
+        if not status["running"]:
+            return status
+        time.sleep(0.01)
+    raise AssertionError("backup did not finish")
+
+
+@pytest.fixture
+def client(db_path, tmp_path, monkeypatch):
+    monkeypatch.setenv("PASTE_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(backup, "DEFAULT_SLEEP", 0)
+    app = Flask(__name__)
+    backup.init_app(app, db_path, backup_dir=str(tmp_path / "backups"))
+    return app.test_client()
+
+
+def test_backup_endpoints(client):
+    assert client.get("/admin/backup").status_code == 404
+    status = run_backup(client, HEADERS)
+
+    assert status["error"] is None
+    assert os.path.exists(status["progress"]["destination"])
+
+
+def test_backup_failure_is_reported(client, tmp_path, full_disk):
+    status = run_backup(client, HEADERS)
+
+    # Not mistaken for a finished backup
+    assert status["error"] == "[Errno 28] No space left on device"
+    assert not [n for n in os.listdir(tmp_path / "backups") if n.endswith(".part")]
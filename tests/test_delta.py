@@ -0,0 +1,176 @@
+import pytest
+
+import storage as storage_module
+from delta import apply_delta, diff_lines, make_delta
+from storage import DELTA_MAX_SIZE, SNAPSHOT_INTERVAL, SQLiteStorage
+
+PAST = "2000-01-01 00:00:00"
+
+
+def stored(storage, paste_id):
+    """Return a row's stored (content, delta, chain_depth, parent_id)."""
+    return (
+        storage._connect()
+        .execute(
+            "SELECT content, delta, chain_depth, parent_id FROM pastes WHERE id = ?",
+            (paste_id,),
+        )
+        .fetchone()
+    )
+
+
+def numbered(count, edit=None):
+    lines = [f"line {i}\n" for i in range(count)]
+    if edit is not None:
+        lines[edit] = "edited\n"
+    return "".join(lines)
+
+
+@pytest.mark.parametrize(
+    ("old", "new"),
+    [
+        ("a\nb\nc\n", "a\nB\nc\n"),
+        ("a\nb\nc", "a\nb\nc\nd"),
+        ("a\nb\n", ""),
+        ("", "new\n"),
+        ("x\r\ny\r\n", "x\r\nz\r\ny\r\n"),
+        ("héllo\n日本\n", "héllo\n🎉\n日本\n"),
+        ("same\n", "same\n"),
+    ],
+)
+def test_round_trip(old, new):
+    assert apply_delta(old, make_delta(old, new)) == new
+
+
+def test_diff_lines():
+    diff = diff_lines("a\nb\n", "a\nc\n", "p1", "p2")
+
+    assert diff.startswith("--- p1\n+++ p2\n")
+    assert "-b\n+c\n" in diff
+    assert diff_lines("a\n", "a\n") == ""
+
+
+def test_diff_lines_too_large():
+    assert diff_lines(numbered(11), numbered(11, edit=3), max_lines=10) is None
+    assert diff_lines(numbered(10), numbered(10, edit=3), max_lines=10)
+
+
+def test_revision_stored_as_delta(sqlite_storage):
+    sqlite_storage.create("p0", numbered(200))
+    sqlite_storage.create("p1", numbered(200, edit=50), parent_id="p0")
+
+    content, delta, depth, parent_id = stored(sqlite_storage, "p1")
+    assert (content, depth, parent_id) == ("", 1, "p0")
+    assert delta is not None
+    assert sqlite_storage.get("p1").content == numbered(200, edit=50)
+    assert sqlite_storage.get_lines("p1", 51, 51) == ("edited\n", 51, 51, 200)
+
+
+def test_missing_parent_is_ignored(sqlite_storage):
+    sqlite_storage.create("p1", numbered(10), parent_id="nope")
+
+    assert stored(sqlite_storage, "p1")[1:] == (None, 0, None)
+
+
+def test_snapshot_interval_rollover(sqlite_storage):
+    sqlite_storage.create("r0", numbered(200))
+    for i in range(1, SNAPSHOT_INTERVAL + 2):
+        sqlite_storage.create(f"r{i}", numbered(200, edit=i), parent_id=f"r{i - 1}")
+
+    depths = [stored(sqlite_storage, f"r{i}")[2] for i in range(SNAPSHOT_INTERVAL + 2)]
+    # The chain restarts from a full copy instead of reaching SNAPSHOT_INTERVAL
+    assert depths == [*range(SNAPSHOT_INTERVAL), 0, 1]
+    assert stored(sqlite_storage, f"r{SNAPSHOT_INTERVAL}")[1] is None
+    for i in range(1, SNAPSHOT_INTERVAL + 2):
+        assert sqlite_storage.get(f"r{i}").content == numbered(200, edit=i)
+
+
+def test_delete_middle_of_chain(sqlite_storage):
+    for i in range(4):
+        parent = f"c{i - 1}" if i else None
+        sqlite_storage.create(f"c{i}", numbered(200, edit=i), parent_id=parent)
+
+    assert sqlite_storage.delete("c1")
+
+    # c2 is stored in full and unlinked; c3 still deltas against it
+    assert stored(sqlite_storage, "c2")[1:] == (None, 0, None)
+    assert stored(sqlite_storage, "c3")[2:] == (1, "c2")
+    for i in (0, 2, 3):
+        assert sqlite_storage.get(f"c{i}").content == numbered(200, edit=i)
+        assert sqlite_storage.get_lines(f"c{i}", i + 1, i + 1)[0] == "edited\n"
+
+
+def test_expire_detaches_children(sqlite_storage):
+    sqlite_storage.create("old", numbered(200), expires_at=PAST)
+    sqlite_storage.create("child", numbered(200, edit=5), parent_id="old")
+
+    assert sqlite_storage.expire() == 1
+    assert stored(sqlite_storage, "child")[1:] == (None, 0, None)
+    assert sqlite_storage.get("child").content == numbered(200, edit=5)
+
+
+def test_large_revisions_stored_in_full(sqlite_storage):
+    count = DELTA_MAX_SIZE // len("line 0000\n") + 1000
+    sqlite_storage.create("big", numbered(count))
+    sqlite_storage.create("big1", numbered(count, edit=7), parent_id="big")
+
+    assert stored(sqlite_storage, "big1")[1:] == (None, 0, "big")
+
+
+def test_delta_made_outside_write_lock(sqlite_storage, monkeypatch):
+    sqlite_storage.create("p0", numbered(200))
+    other = SQLiteStorage(sqlite_storage.db_path, timeout=0.1)
+    make_delta_ = storage_module.make_delta
+
+    def slow_make_delta(old, new):
+        # Another writer must get through while the delta is being made
+        other.create("concurrent", "text")
+        return make_delta_(old, new)
+
+    monkeypatch.setattr(storage_module, "make_delta", slow_make_delta)
+    sqlite_storage.create("p1", numbered(200, edit=1), parent_id="p0")
+
+    assert other.get("concurrent").content == "text"
+    assert stored(sqlite_storage, "p1")[2] == 1
+    other.close()
+
+
+@pytest.mark.parametrize("change", ["delete", "detach"])
+def test_parent_changed_while_diffing(sqlite_storage, monkeypatch, change):
+    sqlite_storage.create("p0", numbered(200))
+    sqlite_storage.create("p1", numbered(200, edit=1), parent_id="p0")
+    other = SQLiteStorage(sqlite_storage.db_path)
+    make_delta_ = storage_module.make_delta
+
+    def racing_make_delta(old, new):
+        # Deleting p0 also stores p1 in full, changing its chain depth
+        other.delete("p1" if change == "delete" else "p0")
+        return make_delta_(old, new)
+
+    monkeypatch.setattr(storage_module, "make_delta", racing_make_delta)
+    sqlite_storage.create("p2", numbered(200, edit=2), parent_id="p1")
+
+    expected_parent = None if change == "delete" else "p1"
+    assert stored(sqlite_storage, "p2")[1:] == (None, 0, expected_parent)
+    assert sqlite_storage.get("p2").content == numbered(200, edit=2)
+    other.close()
+
+
+def test_rebuilt_bodies_are_cached(sqlite_storage, monkeypatch):
+    sqlite_storage.create("p0", numbered(200))
+    sqlite_storage.create("p1", numbered(200, edit=1), parent_id="p0")
+    sqlite_storage.get_lines("p1", 1, 10)
+    calls = []
+    monkeypatch.setattr(
+        storage_module,
+        "apply_delta",
+        lambda old, delta: calls.append(1) or apply_delta(old, delta),
+    )
+
+    assert sqlite_storage.get_lines("p1", 2, 2)[0] == "edited\n"
+    assert sqlite_storage.get_lines("p1", 100, 100)[0] == "line 99\n"
+    assert calls == []
+
+    sqlite_storage.delete("p1")
+    assert sqlite_storage.get_lines("p1", 2, 2) is None
+    assert "p1" not in sqlite_storage._bodies
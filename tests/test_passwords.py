@@ -0,0 +1,143 @@
+import sqlite3
+import time
+
+import pytest
+
+import passwords
+from storage import SQLiteStorage
+
+
+def test_hash_password():
+    stored = passwords.hash_password("hunter2")
+
+    assert passwords.is_hashed(stored)
+    assert passwords.check_password(stored, "hunter2")
+    assert not passwords.check_password(stored, "hunter3")
+    assert not passwords.check_password(stored, "")
+    assert not passwords.check_password(stored, None)
+
+
+def test_plaintext_fallback():
+    assert passwords.check_password("hunter2", "hunter2")
+    assert not passwords.check_password("hunter2", "hunter3")
+    # compare_digest raises TypeError for non-ASCII str
+    assert passwords.check_password("pässwört", "pässwört")
+    assert not passwords.check_password("hunter2", "pässwört")
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A database written before passwords were hashed."""
+    db_path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE pastes (id TEXT PRIMARY KEY, content TEXT NOT NULL, title TEXT,"
+        " created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, expires_at TIMESTAMP,"
+        " password TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO pastes (id, content, password) VALUES (?, 'text', ?)",
+        [
+            ("empty", ""),
+            ("none", None),
+            ("plain", "hunter2"),
+            ("unicode", "pässwört"),
+            ("hashed", passwords.hash_password("hashed")),
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def stored_passwords(storage):
+    rows = storage._connect().execute("SELECT id, password FROM pastes")
+    return dict(rows.fetchall())
+
+
+def test_init_db_clears_empty_passwords(legacy_db):
+    storage = SQLiteStorage(legacy_db)
+    before = stored_passwords(storage)
+    storage.init_db()
+
+    after = stored_passwords(storage)
+    assert after["empty"] is None
+    assert after["none"] is None
+    # Hashing is left to hash_passwords and the first unlock
+    assert after["plain"] == "hunter2"
+    assert after["hashed"] == before["hashed"]
+    assert storage._connect().execute("PRAGMA user_version").fetchone() == (1,)
+    storage.close()
+
+
+def test_hash_passwords(legacy_db):
+    storage = SQLiteStorage(legacy_db)
+    storage.init_db()
+    before = stored_passwords(storage)
+    progress = []
+
+    assert storage.hash_passwords(batch_size=2, progress=progress.append) == 2
+    after = stored_passwords(storage)
+    assert progress[-1] == 2
+    assert passwords.check_password(after["plain"], "hunter2")
+    assert passwords.check_password(after["unicode"], "pässwört")
+    assert after["hashed"] == before["hashed"]
+    assert after["empty"] is None
+    assert storage.hash_passwords() == 0
+    storage.close()
+
+
+@pytest.fixture
+def app(load_app):
+    return load_app("advanced")
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def test_empty_password_is_no_password(app, client):
+    response = client.post("/paste", data={"content": "text", "password": ""})
+    paste_id = response.location.rsplit("/", 1)[1]
+
+    assert app.storage.get(paste_id, content=False).password is None
+    assert client.get(f"/paste/{paste_id}").status_code == 200
+
+
+def test_unlock_hashes_plaintext(app, client):
+    app.storage.create("p1", "secret", password="pässwört")
+
+    wrong = client.post("/paste/p1/unlock", data={"password": "wrong"})
+    assert wrong.status_code == 403
+    assert app.storage.get("p1", content=False).password == "pässwört"
+
+    right = client.post("/paste/p1/unlock", data={"password": "pässwört"})
+    assert right.status_code == 302
+    stored = app.storage.get("p1", content=False).password
+    assert passwords.is_hashed(stored)
+    assert passwords.check_password(stored, "pässwört")
+    assert client.get("/paste/p1/raw").get_data(as_text=True) == "secret"
+
+
+def test_unlock_cookie(app, client):
+    app.storage.create("p1", "one", password=passwords.hash_password("pw"))
+    app.storage.create("p2", "two", password=passwords.hash_password("pw"))
+
+    client.post("/paste/p1/unlock", data={"password": "pw"})
+    assert client.get("/paste/p1/raw").status_code == 200
+    assert client.get("/paste/p2/raw").status_code == 403
+
+    # A token for one paste does not unlock another
+    token = client.get_cookie("unlock_p1", path=passwords.UNLOCK_PATH).value
+    client.set_cookie("unlock_p2", token, path=passwords.UNLOCK_PATH)
+    assert client.get("/paste/p2/raw").status_code == 403
+
+
+def test_unlock_cookie_expires(app, client, monkeypatch):
+    app.storage.create("p1", "one", password=passwords.hash_password("pw"))
+    client.post("/paste/p1/unlock", data={"password": "pw"})
+
+    later = time.time() + passwords.UNLOCK_MAX_AGE + 5
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert client.get("/paste/p1/raw").status_code == 403
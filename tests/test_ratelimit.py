@@ -0,0 +1,160 @@
+import os
+
+import pytest
+from flask import Flask
+
+from ratelimit import (
+    LocalBuckets,
+    SharedBuckets,
+    SharedCounters,
+    client_address,
+    parse_limit,
+    refill,
+    shed_limits,
+    wait_time,
+)
+
+CLIENT = ("client", "write", "10.0.0.1")
+GLOBAL = ("global", "write")
+
+
+def test_refill():
+    # Half a second at 4 tokens/s adds 2 tokens, capped at the burst
+    assert refill(1.0, 10.0, 10.5, 4.0, 10.0) == 3.0
+    assert refill(9.0, 10.0, 20.0, 4.0, 10.0) == 10.0
+
+
+def test_wait_time():
+    limits = [(CLIENT, 2.0, 5.0), (GLOBAL, 10.0, 20.0)]
+
+    assert wait_time([1.0, 3.0], limits) == 0.0
+    # The slowest bucket to refill decides the wait
+    assert wait_time([0.5, 0.0], limits) == pytest.approx(0.25)
+    assert wait_time([0.0, 0.5], limits) == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [("", (1.0, 2.0)), ("5", (5.0, 10.0)), ("5,20", (5.0, 20.0)), ("0.5", (0.5, 1.0))],
+)
+def test_parse_limit(value, expected):
+    assert parse_limit(value, (1.0, 2.0)) == expected
+
+
+@pytest.fixture(params=[LocalBuckets, SharedBuckets])
+def buckets(request):
+    return request.param()
+
+
+def test_burst_then_refill(buckets):
+    limits = [(CLIENT, 1.0, 3.0)]
+
+    assert [buckets.take(limits, 100.0) for _ in range(4)] == [0, 0, 0, 1.0]
+    assert buckets.take(limits, 100.5) == pytest.approx(0.5)
+    assert buckets.take(limits, 101.0) == 0
+
+
+def test_take_all_or_nothing(buckets):
+    client = (CLIENT, 1.0, 5.0)
+    empty_global = (GLOBAL, 1.0, 1.0)
+    assert buckets.take([empty_global], 100.0) == 0
+
+    # Refused by the global bucket, so the client's token is not spent either
+    assert buckets.take([client, empty_global], 100.0) == 1.0
+    assert [buckets.take([client], 100.0) for _ in range(6)] == [0] * 5 + [1.0]
+
+
+def test_clients_are_separate(buckets):
+    other = ("client", "write", "10.0.0.2")
+    buckets.take([(CLIENT, 1.0, 1.0)], 100.0)
+
+    assert buckets.take([(CLIENT, 1.0, 1.0)], 100.0) == 1.0
+    assert buckets.take([(other, 1.0, 1.0)], 100.0) == 0
+
+
+def test_local_buckets_evict_oldest():
+    buckets = LocalBuckets(max_keys=2)
+    for address in ("a", "b", "c"):
+        buckets.take([(("client", "read", address), 1.0, 1.0)], 100.0)
+
+    # "a" fell out of the LRU and starts again with a full bucket
+    assert buckets.take([(("client", "read", "a"), 1.0, 1.0)], 100.0) == 0
+    assert buckets.take([(("client", "read", "c"), 1.0, 1.0)], 100.0) == 1.0
+
+
+def test_counters_total_over_processes():
+    counters = SharedCounters(slots=8)
+    assert counters.adjust("in_flight", 1) == 1
+
+    pid = os.fork()
+    if pid == 0:
+        # Killed mid-request: counted, never given back
+        counters.adjust("in_flight", 1)
+        counters.adjust("writes", 1)
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert counters.adjust("in_flight", 0) == 2
+    assert counters.adjust("writes", 0) == 1
+    counters.release(pid)
+    assert counters.adjust("in_flight", 0) == 1
+    assert counters.adjust("writes", 0) == 0
+    assert counters.adjust("in_flight", -1) == 0
+
+
+def test_counters_reclaim_dead_processes():
+    counters = SharedCounters(slots=2)
+    for _ in range(3):
+        pid = os.fork()
+        if pid == 0:
+            counters.adjust("in_flight", 1)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+    # Without release, each new process cleared the slot of the dead one
+    # before it; this one clears the last
+    assert counters.adjust("in_flight", 0) == 0
+
+
+@pytest.mark.parametrize(
+    ("trusted", "forwarded", "expected"),
+    [
+        (0, "6.6.6.6", "10.0.0.1"),
+        (1, "", "10.0.0.1"),
+        (1, "1.1.1.1", "1.1.1.1"),
+        (1, "6.6.6.6, 1.1.1.1", "1.1.1.1"),
+        (2, "6.6.6.6, 1.1.1.1, 10.0.0.9", "1.1.1.1"),
+        (2, "1.1.1.1", "10.0.0.1"),
+    ],
+)
+def test_client_address(trusted, forwarded, expected):
+    app = Flask(__name__)
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    with app.test_request_context(
+        "/", headers=headers, environ_base={"REMOTE_ADDR": "10.0.0.1"}
+    ):
+        assert client_address(trusted) == expected
+
+
+@pytest.mark.parametrize(
+    ("env", "expected"),
+    [
+        ({}, (64, 16, 500.0)),
+        # serve.py's defaults on a 2-CPU box: 5 sync workers, 1 thread each
+        ({"PASTE_WORKER_SLOTS": "5"}, (64, 2, 500.0)),
+        ({"PASTE_WORKER_SLOTS": "1"}, (64, 1, 500.0)),
+        ({"PASTE_WORKER_SLOTS": "5", "PASTE_SHED_MAX_WRITES": "4"}, (64, 4, 500.0)),
+        ({"PASTE_SHED_MAX_QUEUE_MS": "0"}, (64, 16, 0.0)),
+    ],
+)
+def test_shed_limits(monkeypatch, env, expected):
+    for name in (
+        "PASTE_WORKER_SLOTS",
+        "PASTE_SHED_MAX_IN_FLIGHT",
+        "PASTE_SHED_MAX_WRITES",
+        "PASTE_SHED_MAX_QUEUE_MS",
+    ):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    assert shed_limits() == expected
@@ -0,0 +1,108 @@
+import pytest
+
+from storage import build_line_index, utc_timestamp
+
+PAST = "2000-01-01 00:00:00"
+
+
+@pytest.mark.parametrize(
+    ("content", "offsets"),
+    [
+        ("", [0]),
+        ("\n", [0, 1]),
+        ("a\nb\n", [0, 2, 4]),
+        ("a\nb", [0, 2, 3]),
+        ("a\r\nb\r\n", [0, 3, 6]),
+    ],
+)
+def test_line_index(content, offsets):
+    assert list(build_line_index(content)) == offsets
+
+
+def test_get_lines(storage):
+    storage.create("p1", "one\ntwo\nthree\nfour")
+
+    assert storage.get_lines("p1", 2, 3) == ("two\nthree\n", 2, 3, 4)
+    assert storage.get_lines("p1", 4, 4) == ("four", 4, 4, 4)
+
+
+def test_get_lines_multibyte(storage):
+    # Offsets count characters, so windows must not split multi-byte ones
+    lines = ["héllo\n", "日本語のテキスト\n", "🎉 party 🎉\n", "ascii again"]
+    storage.create("p1", "".join(lines))
+
+    for number, line in enumerate(lines, 1):
+        assert storage.get_lines("p1", number, number)[0] == line
+    assert storage.get_lines("p1", 2, 3)[0] == lines[1] + lines[2]
+
+
+def test_get_lines_crlf(storage):
+    storage.create("p1", "first\r\nsecond\r\nthird\r\n")
+
+    assert storage.get_lines("p1", 2, 2) == ("second\r\n", 2, 2, 3)
+
+
+def test_get_lines_past_end(storage):
+    storage.create("p1", "one\ntwo\nthree\n")
+
+    # Clamped to the last line rather than returning an empty window
+    assert storage.get_lines("p1", 10, 20) == ("three\n", 3, 3, 3)
+    assert storage.get_lines("p1", 2, 99) == ("two\nthree\n", 2, 3, 3)
+
+
+def test_get_lines_missing(storage):
+    assert storage.get_lines("nope", 1, 10) is None
+
+
+def test_get_lines_builds_missing_index(sqlite_storage):
+    sqlite_storage.create("p1", "one\ntwo\n")
+    # As for pastes stored before the line index existed
+    with sqlite_storage._write() as conn:
+        conn.execute("DELETE FROM paste_lines")
+
+    assert sqlite_storage.get_lines("p1", 2, 2) == ("two\n", 2, 2, 2)
+
+
+def test_get_without_content(storage):
+    storage.create("p1", "body", title="Title", language="python")
+
+    paste = storage.get("p1", content=False)
+    assert paste.content is None
+    assert (paste.title, paste.language) == ("Title", "python")
+    assert storage.get("p1").content == "body"
+    assert storage.get("nope") is None
+
+
+def test_recent_skips_expired(storage):
+    storage.create("old", "a", expires_at=PAST)
+    storage.create("new", "b")
+
+    assert [row[0] for row in storage.recent()] == ["new"]
+
+
+def test_set_password(storage):
+    storage.create("p1", "text", password="old")
+    storage.get("p1", content=False)
+
+    assert not storage.set_password("p1", "stale", "new")
+    assert storage.set_password("p1", "old", "new")
+    assert storage.get("p1", content=False).password == "new"
+    assert not storage.set_password("missing", "old", "new")
+
+
+def test_delete(storage):
+    storage.create("p1", "body")
+
+    assert storage.delete("p1") is True
+    assert storage.get("p1") is None
+    assert storage.get_lines("p1", 1, 1) is None
+    assert storage.delete("p1") is False
+
+
+def test_expire(storage):
+    storage.create("old", "a", expires_at=PAST)
+    storage.create("new", "b", expires_at=utc_timestamp(2**31))
+
+    assert storage.expire() == 1
+    assert storage.get("old") is None
+    assert storage.get("new").content == "b"
@@ -0,0 +1,152 @@
+import hashlib
+import io
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+import passwords
+import upload
+from storage import MemoryStorage
+
+MAX_BYTES = 64
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage()
+
+
+@pytest.fixture
+def client(storage):
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = MAX_BYTES
+    app.add_url_rule("/paste/<paste_id>", "view_paste", lambda paste_id: paste_id)
+    ids = iter(f"p{i}" for i in range(1, 100))
+    upload.init_app(app, storage, lambda: next(ids))
+    return app.test_client()
+
+
+def chunked(client, body):
+    """Upload ``body`` without a Content-Length, as a chunked request would."""
+    return client.put(
+        "/paste/upload",
+        input_stream=io.BytesIO(body),
+        content_type="text/plain",
+        headers={"Transfer-Encoding": "chunked"},
+        environ_overrides={"wsgi.input_terminated": True},
+    )
+
+
+def test_read_body():
+    body = "héllo 日本語 🎉\n".encode()
+
+    content, sha256, size = upload.read_body(io.BytesIO(body), 100, chunk_size=3)
+    assert content == body.decode()
+    assert sha256 == hashlib.sha256(body).hexdigest()
+    assert size == len(body)
+
+
+def test_read_body_splits_multibyte_characters():
+    # Every chunk boundary falls inside the 4-byte emoji at some offset
+    body = "🎉".encode() * 4
+    for offset in range(1, 4):
+        stream = io.BytesIO(b"a" * offset + body)
+        content, _, _ = upload.read_body(stream, 100, chunk_size=4)
+        assert content == "a" * offset + "🎉" * 4
+
+
+def test_read_body_too_large():
+    class Stream(io.BytesIO):
+        reads = 0
+
+        def read(self, size=-1):
+            self.reads += 1
+            return super().read(size)
+
+    stream = Stream(b"x" * 100)
+    with pytest.raises(RequestEntityTooLarge):
+        upload.read_body(stream, 10, chunk_size=4)
+    # Stopped at the chunk that went over, not at the end of the body
+    assert stream.reads == 3
+
+
+@pytest.mark.parametrize("body", [b"\xff\xfe", "é".encode()[:1]])
+def test_read_body_invalid_utf8(body):
+    with pytest.raises(BadRequest):
+        upload.read_body(io.BytesIO(body), 100)
+
+
+def test_upload(client, storage):
+    response = client.post(
+        "/paste/upload?title=Notes&language=python",
+        data="print('hi')\n",
+        content_type="text/x-python",
+    )
+
+    assert response.status_code == 201
+    assert response.json == {
+        "id": "p1",
+        "url": "/paste/p1",
+        "size": 12,
+        "sha256": hashlib.sha256(b"print('hi')\n").hexdigest(),
+    }
+    assert response.location == "/paste/p1"
+    paste = storage.get("p1")
+    assert (paste.content, paste.title, paste.language) == (
+        "print('hi')\n",
+        "Notes",
+        "python",
+    )
+    assert paste.password is None
+
+
+def test_upload_hashes_password(client, storage):
+    response = client.put(
+        "/paste/upload",
+        data="secret",
+        content_type="text/plain",
+        headers={upload.PASSWORD_HEADER: "hunter2"},
+    )
+
+    assert response.status_code == 201
+    stored = storage.get("p1", content=False).password
+    assert passwords.is_hashed(stored)
+    assert passwords.check_password(stored, "hunter2")
+
+
+def test_upload_chunked(client, storage):
+    response = chunked(client, "é🎉".encode() * 8)
+
+    assert response.status_code == 201
+    assert storage.get("p1").content == "é🎉" * 8
+
+
+def test_upload_too_large_content_length(client, storage):
+    response = client.put(
+        "/paste/upload", data="x" * (MAX_BYTES + 1), content_type="text/plain"
+    )
+
+    assert response.status_code == 413
+    assert storage.recent() == []
+
+
+def test_upload_too_large_chunked(client, storage):
+    response = chunked(client, b"x" * (MAX_BYTES * 4))
+
+    assert response.status_code == 413
+    assert storage.recent() == []
+
+
+def test_upload_unsupported_type(client):
+    response = client.put("/paste/upload", data=b"\x89PNG", content_type="image/png")
+
+    assert response.status_code == 415
+
+
+@pytest.mark.parametrize("body", [b"", b"\xff\xfe"])
+def test_upload_bad_body(client, storage, body):
+    response = client.put("/paste/upload", data=body, content_type="text/plain")
+
+    assert response.status_code == 400
+    assert storage.recent() == []
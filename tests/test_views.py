@@ -0,0 +1,109 @@
+import math
+import sqlite3
+from collections import Counter
+
+import pytest
+
+from storage import POPULARITY_EPOCH, POPULARITY_HALF_LIFE, popularity_score
+from views import ViewCounter
+
+NOW = POPULARITY_EPOCH + 100 * POPULARITY_HALF_LIFE
+PAST = "2000-01-01 00:00:00"
+
+
+def test_popularity_score_sums_views():
+    # Scores are log2 of decayed views, so adding to a score sums the views
+    score = popularity_score(None, 3, NOW)
+    score = popularity_score(score, 5, NOW)
+
+    assert score == pytest.approx(popularity_score(None, 8, NOW))
+    assert score == pytest.approx(math.log2(8) + 100)
+
+
+def test_popularity_score_decays():
+    old = popularity_score(None, 8, NOW - POPULARITY_HALF_LIFE)
+
+    # Eight views a half-life ago count as four now
+    assert old == pytest.approx(popularity_score(None, 4, NOW))
+    # ...and adding them to a score is the same as adding four now
+    combined = popularity_score(old, 4, NOW)
+    assert combined == pytest.approx(popularity_score(None, 8, NOW))
+
+
+def test_popularity_score_far_apart():
+    # Very old views vanish without overflowing 2 ** (difference)
+    old = popularity_score(None, 1, POPULARITY_EPOCH)
+    later = NOW + 2000 * POPULARITY_HALF_LIFE
+
+    assert popularity_score(old, 1, later) == popularity_score(None, 1, later)
+
+
+def test_popular_ranking(storage):
+    for paste_id in ("a", "b", "c"):
+        storage.create(paste_id, "x", title=paste_id.upper())
+    storage.add_views({"a": 5, "b": 2}, now=NOW)
+    storage.add_views({"b": 2, "c": 1}, now=NOW)
+
+    rows = storage.popular(10)
+    assert [(row[0], row[1], row[3]) for row in rows] == [
+        ("a", "A", 5),
+        ("b", "B", 4),
+        ("c", "C", 1),
+    ]
+    assert [row[0] for row in storage.popular(1)] == ["a"]
+
+
+def test_popular_prefers_recent_views(storage):
+    storage.create("old", "x")
+    storage.create("new", "x")
+    storage.add_views({"old": 10}, now=NOW - 4 * POPULARITY_HALF_LIFE)
+    storage.add_views({"new": 1}, now=NOW)
+
+    # 10 views four half-lives ago are worth 0.625 now
+    assert [row[0] for row in storage.popular(10)] == ["new", "old"]
+
+
+def test_popular_skips_removed(storage):
+    storage.create("gone", "x")
+    storage.create("expired", "x", expires_at=PAST)
+    storage.create("kept", "x")
+    storage.add_views({"gone": 3, "expired": 2, "kept": 1}, now=NOW)
+    storage.delete("gone")
+
+    assert [row[0] for row in storage.popular(10)] == ["kept"]
+
+
+class FlakyStorage:
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def add_views(self, counts):
+        if self.fail:
+            raise sqlite3.OperationalError("database is locked")
+        self.batches.append(Counter(counts))
+
+
+def test_view_counter_batches():
+    backend = FlakyStorage()
+    counter = ViewCounter(backend, interval=3600)
+    for paste_id in ("a", "b", "a"):
+        counter.record(paste_id)
+
+    counter.flush()
+    counter.flush()
+    assert backend.batches == [Counter(a=2, b=1)]
+
+
+def test_view_counter_keeps_views_on_error():
+    backend = FlakyStorage()
+    counter = ViewCounter(backend, interval=3600)
+    counter.record("a")
+
+    backend.fail = True
+    counter.flush()
+    counter.record("a")
+    backend.fail = False
+    counter.flush()
+
+    assert backend.batches == [Counter(a=2)]
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import sys
+import time
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+
+access_log = logging.getLogger("paste.access")
+
+
+def setup_access_log(path):
+    """Send access log records, one JSON object per line, to ``path`` ("-" is stderr)."""
+    handler = (
+        logging.StreamHandler(sys.stderr) if path == "-" else logging.FileHandler(path)
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    access_log.addHandler(handler)
+    access_log.setLevel(logging.INFO)
+    access_log.propagate = False
+
+
+def instrument(app, storage):
+    """Time every request's phases once, for all the code that reports them.
+
+    While a request runs, ``g.timing`` holds its start time, the seconds
+    spent in storage calls (``db``) and rendering templates (``render``),
+    and each render as ``(template name, seconds)`` in ``templates``. When
+    the response is ready ``total`` is filled in and every reporter in the
+    returned list is called with ``(response, timing)``. The hooks are
+    installed once per app, however many modules ask for them.
+    """
+    reporters = app.extensions.get("timing")
+    if reporters is not None:
+        return reporters
+    reporters = app.extensions["timing"] = []
+
+    def add_db_time(event, seconds=None, **fields):
+        if event == "query" and has_request_context() and "timing" in g:
+            g.timing["db"] += seconds
+
+    storage.add_listener(add_db_time)
+
+    def start_render(sender, template, context, **extra):
+        # Only renders inside a timed request; not those of serve.py's warmup
+        if "timing" in g:
+            g.timing["render_started"] = time.perf_counter()
+
+    def end_render(sender, template, context, **extra):
+        timing = g.get("timing")
+        if timing is None or "render_started" not in timing:
+            return
+        seconds = time.perf_counter() - timing.pop("render_started")
+        timing["render"] += seconds
+        timing["templates"].append((template.name, seconds))
+
+    # weak=False: these closures have no other reference keeping them alive
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(end_render, app, weak=False)
+
+    @app.before_request
+    def start_timing():
+        g.timing = {
+            "started": time.perf_counter(),
+            "db": 0.0,
+            "render": 0.0,
+            "templates": [],
+        }
+
+    @app.after_request
+    def report_timing(response):
+        timing = g.pop("timing", None)
+        if timing is None:
+            return response
+        timing["total"] = time.perf_counter() - timing["started"]
+        for reporter in reporters:
+            reporter(response, timing)
+        return response
+
+    return reporters
+
+
+def init_app(app, storage):
+    """Break each request's time into db, render and total phases.
+
+    Every response gets a ``Server-Timing`` header with the three phases in
+    milliseconds. When ``PASTE_ACCESS_LOG`` is set, the same breakdown is
+    also written there as JSON lines, with payload sizes and the paste id.
+    """
+    log_path = os.environ.get("PASTE_ACCESS_LOG")
+    if log_path and not access_log.handlers:
+        setup_access_log(log_path)
+
+    def add_server_timing(response, timing):
+        db_ms = timing["db"] * 1000
+        render_ms = timing["render"] * 1000
+        total_ms = timing["total"] * 1000
+        response.headers["Server-Timing"] = (
+            f"db;dur={db_ms:.2f}, render;dur={render_ms:.2f}, total;dur={total_ms:.2f}"
+        )
+
+        if access_log.handlers:
+            access_log.info(
+                json.dumps(
+                    {
+                        "ts": time.time(),
+                        "method": request.method,
+                        "path": request.path,
+                        "endpoint": request.endpoint,
+                        "status": response.status_code,
+                        "paste_id": (request.view_args or {}).get("paste_id")
+                        or g.get("paste_id"),
+                        "bytes_in": request.content_length or 0,
+                        "bytes_out": response.content_length,
+                        "db_ms": round(db_ms, 3),
+                        "render_ms": round(render_ms, 3),
+                        "total_ms": round(total_ms, 3),
+                        "pid": os.getpid(),
+                    }
+                )
+            )
+
+    instrument(app, storage).append(add_server_timing)
@@ -0,0 +1,83 @@
+import codecs
+import hashlib
+
+from flask import g, jsonify, request, url_for
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+from passwords import hash_password
+
+CHUNK_SIZE = 64 * 1024
+PASSWORD_HEADER = "X-Paste-Password"
+
+
+def is_text_upload(mimetype):
+    return mimetype == "application/octet-stream" or mimetype.startswith("text/")
+
+
+def read_body(stream, max_bytes, chunk_size=CHUNK_SIZE):
+    """Read a UTF-8 body chunk by chunk, hashing it as it arrives.
+
+    Returns ``(content, sha256 hex digest, size in bytes)``. Bodies over
+    ``max_bytes`` and invalid UTF-8 are rejected at the chunk where they
+    show up, without reading the rest.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    digest = hashlib.sha256()
+    parts = []
+    size = 0
+    try:
+        while chunk := stream.read(chunk_size):
+            size += len(chunk)
+            if size > max_bytes:
+                raise RequestEntityTooLarge()
+            digest.update(chunk)
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        raise BadRequest("Paste body must be UTF-8 text") from None
+    return "".join(parts), digest.hexdigest(), size
+
+
+def init_app(app, storage, generate_paste_id):
+    """Add ``/paste/upload``, which takes a paste as the raw request body.
+
+    ``PUT`` or ``POST`` a body of type ``text/*`` or
+    ``application/octet-stream``. The title and language go in the query
+    string, and a password in the ``X-Paste-Password`` header so it stays
+    out of URLs and logs. Unlike the form, the body is never buffered whole
+    by Werkzeug: it is read in CHUNK_SIZE pieces, capped at the app's
+    ``MAX_CONTENT_LENGTH``, and answered with the new paste's id and
+    SHA-256.
+    """
+
+    @app.route("/paste/upload", methods=["POST", "PUT"])
+    def upload_paste():
+        """Create a paste from a streamed request body."""
+        if not is_text_upload(request.mimetype):
+            raise UnsupportedMediaType("Upload text/* or application/octet-stream")
+        max_bytes = app.config["MAX_CONTENT_LENGTH"]
+        if request.content_length and request.content_length > max_bytes:
+            # Refused before a byte of the body is read
+            raise RequestEntityTooLarge()
+
+        content, sha256, size = read_body(request.stream, max_bytes)
+        if not content:
+            raise BadRequest("Paste content cannot be empty")
+
+        password = request.headers.get(PASSWORD_HEADER)
+        paste_id = generate_paste_id()
+        g.paste_id = paste_id  # For the access log
+        storage.create(
+            paste_id,
+            content,
+            title=request.args.get("title", "Untitled"),
+            password=hash_password(password) if password else None,
+            language=request.args.get("language", "plaintext"),
+        )
+
+        url = url_for("view_paste", paste_id=paste_id)
+        response = jsonify(id=paste_id, url=url, size=size, sha256=sha256)
+        response.status_code = 201
+        response.headers["Location"] = url
+        response.set_etag(sha256)
+        return response
@@ -0,0 +1,55 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger("paste.views")
+
+
+class ViewCounter:
+    """Count paste views in memory and write them out in batches.
+
+    ``record`` only bumps an in-process counter, so a read never waits on
+    SQLite's writer lock. A background thread hands everything counted to
+    ``storage.add_views`` every ``interval`` seconds, one transaction per
+    flush however many views it holds. The thread is started on first use
+    in each process, since threads do not survive gunicorn's fork. Views
+    still pending when a worker is killed are lost.
+    """
+
+    def __init__(self, storage, interval=5.0):
+        self.storage = storage
+        self.interval = interval
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def record(self, paste_id):
+        with self._lock:
+            self._counts[paste_id] += 1
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+                atexit.register(self.flush)
+
+    def flush(self):
+        """Write out the views counted so far."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        try:
+            self.storage.add_views(counts)
+        except sqlite3.Error:
+            logger.exception("Could not flush %d paste views", counts.total())
+            # Keep them for the next flush
+            with self._lock:
+                self._counts.update(counts)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()